@@ -3,11 +3,13 @@ from .container import DataContainer
 from .datalist import DataListGenerator
 from .image import ImageData, SingleImage
 from .patch import DataPatch
+from .validator import DatasetValidator, ValidationReport
 
 __all__ = [
     'DataCluster',
     'DataContainer',
     'DataListGenerator',
     'ImageData', 'SingleImage',
-    'DataPatch'
+    'DataPatch',
+    'DatasetValidator', 'ValidationReport'
 ]
\ No newline at end of file
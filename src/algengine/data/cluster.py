@@ -1,18 +1,33 @@
 import os
 import math
 import random
-import numpy as np
+import concurrent.futures
 
+from hashlib import blake2b
+from operator import attrgetter
 from typing import Optional, List, Union, Tuple, NoReturn
 
 from .image import ImageData
 from .container import DataContainer
+from .validator import DatasetValidator
 from ..utils import PathFormatter, SuffixFormatter, scandir
 
 
+def _rebuild_cluster(cls, state: dict, items: List) -> 'DataCluster':
+    """ Unpickle a DataCluster, the items are restored before the slots so that no override is involved. """
+    cluster = cls.__new__(cls)
+    list.extend(cluster, items)
+    for slot, value in state.items():
+        setattr(cluster, slot, value)
+    return cluster
+
+
 class DataCluster(list):
     __slots__ = ['_path', '_root', '_duplicates',
-                 '_separated', '_clean_raw_label', '_hard_samples']
+                 '_separated', '_clean_raw_label', '_hard_samples', '_entries', '_image_kwargs']
+
+    SPLIT_MODES = ['shuffle', 'hash']
+    HASH_BY = ['name', 'md5']
 
 
     def __init__(self,
@@ -31,6 +46,7 @@ class DataCluster(list):
                  require_all: bool = True,
                  prohibit_all: bool = True,
                  prohibited: Union[str, List[str], None] = None,
+                 lazy: bool = False,
                  **kwargs):
         """ List of ImageData.
 
@@ -48,10 +64,14 @@ class DataCluster(list):
             duplicates (int): Number of duplicates.
             required (str, List[str], optional): Required attributes.
             require_all (bool): Whether to require all attributes.
+            lazy (bool): Whether to keep the listing only and create ImageData on first access.
         """
 
         super(DataCluster, self).__init__()
 
+        self._entries = None
+        self._image_kwargs = None
+
         self._path = PathFormatter.format(path)
 
         self._separated = separated
@@ -68,7 +88,8 @@ class DataCluster(list):
                       required=required,
                       require_all=require_all,
                       prohibited=prohibited,
-                      prohibit_all=prohibit_all
+                      prohibit_all=prohibit_all,
+                      lazy=lazy
                       )
 
 
@@ -87,12 +108,13 @@ class DataCluster(list):
     @property
     def data(self) -> DataContainer:
         data = DataContainer(allow_duplicates=(True if self._duplicates > 1 else False))
-        data[self.label] = self.copy() * self._duplicates
+        data[self.label] = (self._lazy_copy(self._entries * self._duplicates) if self.is_lazy
+                            else self.copy() * self._duplicates)
         return data
 
     @property
     def raw_data(self) -> List:
-        return self.copy()
+        return self._lazy_copy(list(self._entries)) if self.is_lazy else self.copy()
 
     @classmethod
     def from_path(cls,
@@ -110,6 +132,7 @@ class DataCluster(list):
                   duplicates: Optional[int] = None,
                   required: Union[str, List[str], None] = None,
                   require_all: bool = True,
+                  lazy: bool = False,
                   **kwargs):
 
         return cls(path=path,
@@ -127,6 +150,7 @@ class DataCluster(list):
                    duplicates=duplicates,
                    required=required,
                    require_all=require_all,
+                   lazy=lazy,
                    **kwargs)
 
     @staticmethod
@@ -187,6 +211,122 @@ class DataCluster(list):
             print(f'Cluster is empty: {self.path}')
         return not self
 
+    @property
+    def is_lazy(self) -> bool:
+        return getattr(self, '_entries', None) is not None
+
+    def _materialize(self) -> NoReturn:
+        """ Create ImageData for the listed entries, no file system access is needed. """
+        if self.is_lazy:
+            entries, self._entries = self._entries, None
+            super(DataCluster, self).extend(ImageData(file_path=file_path, check_exists=False, **self._image_kwargs)
+                                            for file_path in entries)
+
+    def _lazy_copy(self, entries: List[str]) -> 'DataCluster':
+        """ Cluster with the same settings listing the entries, whose ImageData are created on its first access. """
+        cluster = _rebuild_cluster(type(self), self._state(), [])
+        cluster._entries = entries
+        return cluster
+
+    def _state(self) -> dict:
+        return {slot: getattr(self, slot, None) for slot in self.__slots__}
+
+    def __reduce__(self):
+        # the listing of a lazy cluster is pickled as it is, so it is still lazy after unpickling
+        return _rebuild_cluster, (type(self), self._state(), list(super(DataCluster, self).__iter__()))
+
+    def __len__(self) -> int:
+        return len(self._entries) if self.is_lazy else super(DataCluster, self).__len__()
+
+    def __repr__(self) -> str:
+        # the backing list of a lazy cluster is empty until it is materialised
+        if self.is_lazy:
+            return f'<DataCluster {self._path!r}: lazy, {len(self._entries)} entries>'
+        return super(DataCluster, self).__repr__()
+
+    def __iter__(self):
+        self._materialize()
+        return super(DataCluster, self).__iter__()
+
+    def __getitem__(self, item):
+        self._materialize()
+        return super(DataCluster, self).__getitem__(item)
+
+    def __contains__(self, item) -> bool:
+        self._materialize()
+        return super(DataCluster, self).__contains__(item)
+
+    def append(self, item) -> NoReturn:
+        self._materialize()
+        super(DataCluster, self).append(item)
+
+    def extend(self, items) -> NoReturn:
+        self._materialize()
+        super(DataCluster, self).extend(items)
+
+    def copy(self) -> List:
+        self._materialize()
+        return super(DataCluster, self).copy()
+
+    def __setitem__(self, key, value) -> NoReturn:
+        self._materialize()
+        super(DataCluster, self).__setitem__(key, value)
+
+    def __delitem__(self, key) -> NoReturn:
+        self._materialize()
+        super(DataCluster, self).__delitem__(key)
+
+    def __eq__(self, other) -> bool:
+        self._materialize()
+        return super(DataCluster, self).__eq__(other)
+
+    def __add__(self, other) -> List:
+        return self.copy() + list(other)
+
+    def __radd__(self, other) -> List:
+        return list(other) + self.copy()
+
+    def __iadd__(self, other) -> 'DataCluster':
+        self.extend(other)
+        return self
+
+    def __mul__(self, n: int) -> List:
+        return self.copy() * n
+
+    __rmul__ = __mul__
+
+    def insert(self, index: int, item) -> NoReturn:
+        self._materialize()
+        super(DataCluster, self).insert(index, item)
+
+    def pop(self, index: int = -1):
+        self._materialize()
+        return super(DataCluster, self).pop(index)
+
+    def remove(self, item) -> NoReturn:
+        self._materialize()
+        super(DataCluster, self).remove(item)
+
+    def index(self, item, *args) -> int:
+        self._materialize()
+        return super(DataCluster, self).index(item, *args)
+
+    def count(self, item) -> int:
+        self._materialize()
+        return super(DataCluster, self).count(item)
+
+    def sort(self, **kwargs) -> NoReturn:
+        self._materialize()
+        super(DataCluster, self).sort(**kwargs)
+
+    def reverse(self) -> NoReturn:
+        self._materialize()
+        super(DataCluster, self).reverse()
+
+    def clear(self) -> NoReturn:
+        self._entries = None
+        super(DataCluster, self).clear()
+
     def load(self,
              ignore_ref: bool = False,
              ignore_gerb: bool = False,
@@ -197,14 +337,27 @@ class DataCluster(list):
              strict_inspection: bool = False,
              prohibit_all: bool = True,
              prohibited: Union[str, List[str], None] = None,
+             lazy: bool = False,
              **kwargs) -> NoReturn:
 
         cur_path = self.path if not self._separated else os.path.join(self.path, 'Cur')
-        data = [ImageData(file_path=os.path.join(cur_path, img_path),
-                          use_single_image=use_single_image,
-                          separated=self._separated,
-                          strict_inspection=strict_inspection,
-                          hard_sample=self._hard_samples)
+        image_kwargs = dict(use_single_image=use_single_image,
+                            separated=self._separated,
+                            strict_inspection=strict_inspection,
+                            hard_sample=self._hard_samples)
+
+        if lazy and required is None and prohibited is None and not self:
+            # file type is taken from the listing, the existence checks of ImageData are not needed
+            with os.scandir(cur_path) as entries:
+                self._entries = [entry.path for entry in entries
+                                 if entry.is_file() and self.file_name_check(file_path=entry.name,
+                                                                             ignore_ref=ignore_ref,
+                                                                             ignore_gerb=ignore_gerb,
+                                                                             skip_cur_check=skip_cur_check)]
+            self._image_kwargs = image_kwargs
+            return
+
+        data = [ImageData(file_path=os.path.join(cur_path, img_path), **image_kwargs)
                 for img_path in os.listdir(cur_path)
                 if self.file_name_check(file_path=img_path,
                                         ignore_ref=ignore_ref,
@@ -239,12 +392,62 @@ class DataCluster(list):
 
         self.extend(data)
 
-    def split(self, split_ratio: float = 0.8, random_seed: int = 42) -> Tuple[List, List]:
+    @staticmethod
+    def hash_ratio(key: str, random_seed: int = 42) -> float:
+        """ Map the key to [0, 1) with a keyed hash, the result only depends on the key and the seed. """
+        digest = blake2b(key.encode(), digest_size=8, key=str(random_seed).encode()).digest()
+        return int.from_bytes(digest, 'big') / 18446744073709551616  # 2 ** 64
+
+    def _split_keys(self, hash_by: str = 'name', num_workers: Optional[int] = None) -> List[str]:
+        assert hash_by in self.HASH_BY, f'hash_by must be in {self.HASH_BY}, {hash_by} is given'
+        if hash_by == 'name':
+            if self.is_lazy:
+                return [os.path.basename(file_path) for file_path in self._entries]
+            return [img.name for img in self]
+        if num_workers is not None and num_workers > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as exe:
+                return list(exe.map(attrgetter('md5'), self))
+        return [img.md5 for img in self]
+
+    def split(self,
+              split_ratio: float = 0.8,
+              random_seed: int = 42,
+              split_mode: str = 'shuffle',
+              hash_by: str = 'name',
+              num_workers: Optional[int] = None) -> Tuple[List, List]:
+        """ Split the cluster into train and val.
+
+        Args:
+            split_ratio (float): Ratio of train data, hard samples are always in train.
+            random_seed (int): Seed of the shuffle, or the key of the hash.
+            split_mode (str): "shuffle" shuffles a copy of the cluster and cuts it at the ratio.
+                "hash" assigns every image by the keyed hash of its name or md5 against the ratio,
+                the assignment is stable when images are added to or removed from the cluster.
+            hash_by (str): "name" or "md5", the key of the hash in "hash" split_mode.
+            num_workers (int, optional): Number of threads to compute md5.
+
+        A lazy cluster is split on its listing and gives lazy clusters, except for the md5 hash which needs the
+        images, the ImageData are created when the results are accessed.
+        """
+        assert split_mode in self.SPLIT_MODES, f'split_mode must be in {self.SPLIT_MODES}, {split_mode} is given'
         split_ratio = 1 if self._hard_samples else split_ratio
+        if split_mode == 'hash':
+            keys = self._split_keys(hash_by=hash_by, num_workers=num_workers)
+            items = self._entries if self.is_lazy else self
+            train, val = [], []
+            for item, key in zip(items, keys):
+                (train if self.hash_ratio(key, random_seed) < split_ratio else val).append(item)
+            if self.is_lazy:
+                return self._lazy_copy(train * self._duplicates), self._lazy_copy(val)
+            return train * self._duplicates, val
+
         offset = math.ceil(len(self) * split_ratio)
-        data = self.copy()
+        lazy = self.is_lazy
+        data = list(self._entries) if lazy else self.copy()
         random.seed(random_seed)
         random.shuffle(data)
+        if lazy:
+            return self._lazy_copy(data[:offset] * self._duplicates), self._lazy_copy(data[offset:])
         return data[:offset] * self._duplicates, data[offset:]
 
     @classmethod
@@ -262,6 +465,7 @@ class DataCluster(list):
                              duplicates: Optional[int] = None,
                              required: Union[str, List[str], None] = None,
                              require_all: bool = True,
+                             validator: Optional[DatasetValidator] = None,
                              **kwargs):
         try:
             if duplicates is None:
@@ -306,6 +510,11 @@ class DataCluster(list):
             raise IndexError(
                 f'Invalid file structure: {path}, scanned: {scanned.total_num}, loaded: {dc.data.total_num}')
 
+        if validator is not None:
+            report = validator.validate(dc)
+            if not report.is_valid:
+                raise IndexError(f'Invalid images: {path}, {report.summary()}')
+
         return dc
 
 
@@ -70,6 +70,32 @@ class DataContainer(defaultdict):
                 ret[k] = list(set(ret[k]))
         return ret
 
+    def merge_from(self, *others: 'DataContainer') -> 'DataContainer':
+        """ Merge the other containers into the current one in place.
+
+        "+=" rebinds the name to a new container like "+", while the other references keep the old one.
+        Unlike "+", the accumulated container is not copied for every merge and every key is
+        deduplicated against a set which is built once, so merging N containers costs O(N).
+        """
+        seen = dict()
+        for other in others:
+            assert isinstance(other, DataContainer), f'Cannot add DataContainer with {type(other)}'
+            allow_duplicates = self.allow_duplicates or other.allow_duplicates
+            for k, v in other.items():
+                if allow_duplicates:
+                    self[k].extend(v)
+                    if k in seen:
+                        seen[k].update(v)
+                    continue
+                if k not in seen:
+                    seen[k] = set(self[k])
+                key_seen, key_data = seen[k], self[k]
+                for img in v:
+                    if img not in key_seen:
+                        key_seen.add(img)
+                        key_data.append(img)
+        return self
+
     @classmethod
     def from_scan_dir(cls,
                       src: str,
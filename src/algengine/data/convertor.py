@@ -1,18 +1,381 @@
 import os
 import cv2
+import json
+import os.path as osp
 
+import warnings
+import threading
 import numpy as np
+import concurrent.futures
+from hashlib import md5
 from tqdm import tqdm
-from typing import Union, Optional
+from functools import partial
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Union, Optional, Dict, Tuple, List, Callable
 
 
 from .mappers import ClassMapper
 from .container import DataContainer
+from ..utils import read_palette_png, write_palette_png
+
+
+class ColorLUT:
+    """
+    Read-only lookup table from the colors of a color map to their indices, 255 for the colors not in the map.
+
+    The table is indexed by the 24-bit keys (c0 << 16) | (c1 << 8) | c2 of the colors, in the color space of
+    the color map. A table is built once per version of a color map (see "get") and can be moved to shared memory
+    (see "share"), so that pickling it for a worker process only sends the name of the shared block.
+
+    Args:
+        color_map (dict): {color: idx}, idx in range [0, 255).
+    """
+    SIZE = 1 << 24  # 256 * 256 * 256
+    UNKNOWN = 255
+    MAX_CACHED = 8
+
+    _cache: 'OrderedDict[str, ColorLUT]' = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, color_map: Optional[Dict[Tuple[int, int, int], int]] = None):
+        self.fingerprint = None
+        self.table = None
+        self._shm = None
+        self._owner = False
+        if color_map is not None:
+            assert all(0 <= idx < self.UNKNOWN for idx in color_map.values()), \
+                f'idx in color_map must be in range [0, {self.UNKNOWN}), {sorted(set(color_map.values()))} is given'
+            self.fingerprint = self.fingerprint_of(color_map)
+            self.table = np.full(self.SIZE, self.UNKNOWN, dtype=np.uint8)
+            if color_map:
+                colors = np.array(list(color_map.keys()), dtype=np.uint32).reshape(-1, 3)
+                self.table[(colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]] = list(color_map.values())
+            self.table.setflags(write=False)
+
+    @staticmethod
+    def fingerprint_of(color_map: Dict[Tuple[int, int, int], int]) -> str:
+        """ Short digest of the color map, changes with any color or index of the map. """
+        items = sorted((tuple(int(c) for c in color), int(idx)) for color, idx in color_map.items())
+        return md5(repr(items).encode()).hexdigest()[:12]
+
+    @classmethod
+    def get(cls, color_map: Union['ColorLUT', Dict[Tuple[int, int, int], int]]) -> 'ColorLUT':
+        """ The cached table of the color map, built on the first call for each version of the map. """
+        if isinstance(color_map, ColorLUT):
+            return color_map
+        fingerprint = cls.fingerprint_of(color_map)
+        with cls._lock:
+            lut = cls._cache.get(fingerprint)
+            if lut is None:
+                lut = cls._cache[fingerprint] = cls(color_map)
+                while len(cls._cache) > cls.MAX_CACHED:
+                    cls._cache.popitem(last=False)
+            else:
+                cls._cache.move_to_end(fingerprint)
+        return lut
+
+    @staticmethod
+    def pack(img: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ 24-bit uint32 keys of the (..., 3) colors, computed with shifts without any int64 intermediate. """
+        keys = np.left_shift(img[..., 0], 16, dtype=np.uint32, out=out)
+        keys |= np.left_shift(img[..., 1], 8, dtype=np.uint32)
+        keys |= img[..., 2]
+        return keys
+
+    def __call__(self,
+                 img: np.ndarray,
+                 out: Optional[np.ndarray] = None,
+                 require_color_in_mapper: bool = True) -> np.ndarray:
+        """
+        Args:
+            img (np.ndarray): (..., C) uint8 image, the first 3 channels in the color space of the color map.
+            out (np.ndarray, optional): preallocated uint8 output of shape img.shape[:-1].
+            require_color_in_mapper (bool): raise ValueError if img has colors not in the color map.
+        """
+        assert img.dtype == np.uint8, f'img must be uint8, {img.dtype} is given'
+        if out is None:
+            out = np.empty(img.shape[:-1], dtype=np.uint8)
+        np.take(self.table, self.pack(img), out=out)
+        if require_color_in_mapper and np.any(out == self.UNKNOWN):
+            raise ValueError('img has some colors not in color_map!')
+        return out
+
+    @property
+    def shared_name(self) -> Optional[str]:
+        return None if self._shm is None else self._shm.name
+
+    def copy(self) -> 'ColorLUT':
+        """ Table which is shared and closed on its own, e.g. for one run, the cached table is left untouched. """
+        lut = ColorLUT()
+        lut.fingerprint = self.fingerprint
+        # a table in shared memory is copied, as its block may be closed by its owner
+        lut.table = self.table if self._shm is None else self.table.copy()
+        lut.table.setflags(write=False)
+        return lut
+
+    def share(self) -> str:
+        """ Move the table to shared memory, returns the name of the block, unlinked by "close". """
+        if self._shm is None:
+            shm = shared_memory.SharedMemory(create=True, size=self.SIZE)
+            table = np.ndarray((self.SIZE,), dtype=np.uint8, buffer=shm.buf)
+            table[:] = self.table
+            table.setflags(write=False)
+            self._shm, self._owner, self.table = shm, True, table
+        return self._shm.name
+
+    @classmethod
+    def attach(cls, name: str, fingerprint: str) -> 'ColorLUT':
+        """ Read-only table in the shared memory block of another process. """
+        lut = cls()
+        try:
+            # the block is unlinked by its owner only
+            lut._shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            lut._shm = shared_memory.SharedMemory(name=name)
+        lut.table = np.ndarray((cls.SIZE,), dtype=np.uint8, buffer=lut._shm.buf)
+        lut.table.setflags(write=False)
+        lut.fingerprint = fingerprint
+        return lut
+
+    def close(self) -> None:
+        if self._shm is not None:
+            self.table = self.table.copy()
+            self.table.setflags(write=False)
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+            self._shm, self._owner = None, False
+
+    def __reduce__(self):
+        if self._shm is not None:
+            return ColorLUT.attach, (self._shm.name, self.fingerprint)
+        return super(ColorLUT, self).__reduce__()
+
+    def __repr__(self):
+        return f'ColorLUT(fingerprint={self.fingerprint}, shared={self.shared_name})'
+
+
+class _DeprecatedTable(object):
+    """ Class attribute of the former uncompiled lookup, rebuilt on each access with a DeprecationWarning. """
+
+    def __init__(self, fget: Callable[[], np.ndarray]):
+        self.fget = fget
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner) -> np.ndarray:
+        warnings.warn(f'ImageConvertor.{self.name} is deprecated, use ColorLUT.get(color_map) instead',
+                      DeprecationWarning, stacklevel=2)
+        return self.fget()
+
+
+def _legacy_idx_map() -> np.ndarray:
+    """ uint32 table of the most recently used color map, 4294967295 for the unknown colors. """
+    with ColorLUT._lock:
+        lut = next(reversed(ColorLUT._cache.values()), None)
+    idx_map = np.full(ColorLUT.SIZE, np.iinfo(np.uint32).max, dtype=np.uint32)
+    if lut is not None:
+        known = lut.table != ColorLUT.UNKNOWN
+        idx_map[known] = lut.table[known]
+    return idx_map
+
+
+def _is_up_to_date(src: str, dst: str) -> bool:
+    return osp.isfile(dst) and os.stat(dst).st_mtime_ns >= os.stat(src).st_mtime_ns
+
+
+def _convert_one(src: str,
+                 dst: str,
+                 overwrite: bool,
+                 transform: Callable[[np.ndarray], np.ndarray],
+                 imread_flag: int,
+                 writer: Callable[[str, np.ndarray], bool]) -> Tuple[str, str, str]:
+    """ Convert src to dst, returns (status, src, detail) with status in "converted", "skipped" and "failed". """
+    try:
+        if not osp.isfile(src):
+            return 'failed', src, 'does not exist'
+        # a conversion in place is never up-to-date
+        if not overwrite and dst != src and _is_up_to_date(src, dst):
+            return 'skipped', src, ''
+        img = cv2.imread(src, imread_flag)
+        if img is None:
+            return 'failed', src, 'failed to decode'
+        out = transform(img)
+        os.makedirs(osp.dirname(dst) or '.', exist_ok=True)
+        root, ext = osp.splitext(dst)
+        tmp_path = f'{root}.{os.getpid()}.{threading.get_ident()}{ext}'
+        if not writer(tmp_path, out):
+            return 'failed', src, f'failed to encode {dst}'
+        os.replace(tmp_path, dst)
+        return 'converted', src, ''
+    except Exception as e:
+        return 'failed', src, f'{type(e).__name__}: {e}'
+
+
+def _convert_chunk(items: List[Tuple[str, str, bool]],
+                   transform: Callable[[np.ndarray], np.ndarray],
+                   imread_flag: int,
+                   writer: Callable[[str, np.ndarray], bool],
+                   num_threads: int) -> List[Tuple[str, str, str]]:
+    """ Convert a chunk of (src, dst, overwrite) in a worker, decoding and encoding in threads. """
+    convert = partial(_convert_one, transform=transform, imread_flag=imread_flag, writer=writer)
+    if num_threads <= 1:
+        return [convert(*item) for item in items]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as exe:
+        return list(exe.map(convert, *zip(*items)))
+
+
+class ConversionReport(object):
+    def __init__(self):
+        self.converted = 0
+        self.skipped = 0
+        self.failures: List[Tuple[str, str]] = []
+
+    def update(self, results: List[Tuple[str, str, str]]) -> None:
+        for status, src, detail in results:
+            if status == 'failed':
+                self.failures.append((src, detail))
+            else:
+                setattr(self, status, getattr(self, status) + 1)
+
+    @property
+    def num_processed(self) -> int:
+        return self.converted + self.skipped + len(self.failures)
+
+    def summary(self) -> str:
+        return f'converted: {self.converted}, skipped: {self.skipped}, failed: {len(self.failures)}'
+
+    def __str__(self) -> str:
+        return self.summary()
+
+
+class ConversionPipeline(object):
+    """
+    Convert images to images in a process pool, e.g. color masks to id-masks. Each worker converts chunks of
+    (src, dst) with threads, the outputs not older than their sources are skipped unless overwrite is True.
+
+    The transform is pickled once per chunk, pass a shared ColorLUT (see "ColorLUT.share") in it to avoid copying
+    the table to every worker.
+
+    With a fingerprint of the transform, e.g. "ColorLUT.fingerprint", the fingerprint of every output is recorded
+    in a manifest (MANIFEST_NAME) in the output directory, the outputs of another fingerprint or not in the
+    manifest are converted again even if they are up-to-date.
+
+    Args:
+        transform (Callable): picklable function from the decoded src image to the image to be written.
+        imread_flag (int): flag of cv2.imread for the src images.
+        num_workers (int): number of processes, converted in the current process if not greater than 1.
+        num_threads (int): number of threads in each worker.
+        chunk_size (int): number of images converted by a worker at a time.
+        overwrite (bool): whether to convert the up-to-date outputs again.
+        writer (Callable): picklable function writing the output image to a path, cv2.imwrite by default.
+        fingerprint (str, optional): fingerprint of the transform.
+    """
+    MANIFEST_NAME = '.conversion_manifest.json'
+
+    def __init__(self,
+                 transform: Callable[[np.ndarray], np.ndarray],
+                 imread_flag: int = cv2.IMREAD_COLOR,
+                 num_workers: int = 6,
+                 num_threads: int = 4,
+                 chunk_size: int = 16,
+                 overwrite: bool = False,
+                 writer: Callable[[str, np.ndarray], bool] = cv2.imwrite,
+                 fingerprint: Optional[str] = None):
+        self.transform = transform
+        self.writer = writer
+        self.imread_flag = imread_flag
+        self.num_workers = num_workers
+        self.num_threads = num_threads
+        self.chunk_size = chunk_size
+        self.overwrite = overwrite
+        self.fingerprint = fingerprint
+
+    def _load_manifests(self, pairs: List[Tuple[str, str]]) -> Dict[str, Dict[str, str]]:
+        """ {output directory: {output name: fingerprint}}, empty for the missing or broken manifests. """
+        manifests = dict()
+        for directory in set(osp.dirname(dst) for _, dst in pairs):
+            manifests[directory] = dict()
+            try:
+                with open(osp.join(directory, self.MANIFEST_NAME), 'r') as f:
+                    manifests[directory] = dict(json.load(f))
+            except (OSError, ValueError, TypeError):
+                pass
+        return manifests
+
+    def _save_manifests(self, manifests: Dict[str, Dict[str, str]]) -> None:
+        for directory, manifest in manifests.items():
+            if not osp.isdir(directory):
+                continue
+            manifest_file = osp.join(directory, self.MANIFEST_NAME)
+            temp_file = f'{manifest_file}.{os.getpid()}.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(manifest, f, indent=4, sort_keys=True)
+            os.replace(temp_file, manifest_file)
+
+    def run(self, pairs: List[Tuple[str, str]], review: bool = True) -> ConversionReport:
+        """
+        Args:
+            pairs (List[Tuple[str, str]]): (src, dst) of the images.
+            review (bool): whether to show the progress and print the summary and the failures.
+        """
+        manifests = dict() if self.fingerprint is None else self._load_manifests(pairs)
+        items = [(src, dst, self.overwrite or (self.fingerprint is not None and
+                                               manifests[osp.dirname(dst)].get(osp.basename(dst)) != self.fingerprint))
+                 for src, dst in pairs]
+        dst_of = dict(pairs)
+        chunks = [items[i:i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+        convert_args = (self.transform, self.imread_flag, self.writer, self.num_threads)
+
+        report = ConversionReport()
+
+        def on_results(results: List[Tuple[str, str, str]]) -> None:
+            report.update(results)
+            if self.fingerprint is not None:
+                for status, src, _ in results:
+                    dst = dst_of[src]
+                    manifest = manifests[osp.dirname(dst)]
+                    if status == 'failed':
+                        manifest.pop(osp.basename(dst), None)
+                    else:
+                        manifest[osp.basename(dst)] = self.fingerprint
+
+        try:
+            with tqdm(total=len(pairs), disable=not review) as pbar:
+                if self.num_workers is None or self.num_workers <= 1:
+                    for chunk in chunks:
+                        on_results(_convert_chunk(chunk, *convert_args))
+                        pbar.update(len(chunk))
+                        pbar.set_postfix(failed=len(report.failures))
+                else:
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers) as exe:
+                        futures = {exe.submit(_convert_chunk, chunk, *convert_args): chunk for chunk in chunks}
+                        for future in concurrent.futures.as_completed(futures):
+                            try:
+                                results = future.result()
+                            except Exception as e:
+                                results = [('failed', src, f'{type(e).__name__}: {e}') for src, _, _ in futures[future]]
+                            on_results(results)
+                            pbar.update(len(futures[future]))
+                            pbar.set_postfix(failed=len(report.failures))
+        finally:
+            # the outputs converted before an interruption are recorded as well
+            self._save_manifests(manifests)
+
+        if review:
+            print(f'Converted: {report.summary()}')
+            for src, detail in report.failures:
+                print(f'Failed: {src} ({detail})')
+        return report
 
 
 class ImageConvertor:
-    idx_map = np.zeros(16777216, dtype=np.uint32) - 1  # 256 * 256 * 256
-    weights = np.array([65536, 256, 1], dtype=np.int32)  # 256 * 256, 256, 1
+    idx_map = _DeprecatedTable(_legacy_idx_map)  # 256 * 256 * 256
+    weights = _DeprecatedTable(lambda: np.array([65536, 256, 1], dtype=np.int32))  # 256 * 256, 256, 1
+    id_cache_dir = osp.join(osp.expanduser('~'), '.cache', 'algengine', 'id_masks')
 
     def __init__(self,
                  data: Union[DataContainer, str],
@@ -35,19 +398,113 @@ class ImageConvertor:
         self.color_mapper = color_map
 
     @staticmethod
-    def color2idx(img: np.ndarray, color_map: dict, require_color_in_mapper: bool = True):
+    def color2idx(img: np.ndarray,
+                  color_map: Union[ColorLUT, dict],
+                  require_color_in_mapper: bool = True,
+                  out: Optional[np.ndarray] = None):
         # img and color_map should be in the same color space
         img_shape = img.shape
         assert 3 <= len(img_shape) <= 4, f'img shape should be (H, W, C) or (N, H, W, C), got {img_shape}'
-        img = img[..., :3]
         assert img_shape[-1] == 3, f'img given must be RGB or BGR, given channel number of {img_shape}'
+        return ColorLUT.get(color_map)(img, out=out, require_color_in_mapper=require_color_in_mapper)
 
+    @staticmethod
+    def get_palette(color_map: Union[ClassMapper, dict], color_space: str = 'BGR') -> np.ndarray:
+        """ RGB palette (N, 3) of the indices [0, N) in color_map, the first color of each index is used. """
+        assert color_space in ['BGR', 'RGB'], f'color_space must be in ["BGR", "RGB"], {color_space} is given'
+        if isinstance(color_map, ClassMapper):
+            color_map, color_space = color_map.rgb_to_idx, 'RGB'
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        assigned = set()
         for color, idx in color_map.items():
-            ImageConvertor.idx_map[np.dot(color, ImageConvertor.weights)] = idx
-        img_id = ImageConvertor.idx_map[np.dot(img, ImageConvertor.weights)]
-        if np.any(img_id == 4294967295) and require_color_in_mapper:
-            raise ValueError(f'img has some colors not in color_map!')
-        return np.uint8(img_id.copy())
+            if idx not in assigned:
+                palette[idx] = color if color_space == 'RGB' else color[::-1]
+                assigned.add(idx)
+        return palette[:max(assigned, default=0) + 1]
+
+    @staticmethod
+    def palette2idx(index: np.ndarray,
+                    palette: np.ndarray,
+                    color_map: Union[ColorLUT, dict],
+                    color_space: str = 'BGR',
+                    require_color_in_mapper: bool = True) -> np.ndarray:
+        """
+        Id-mask of the index plane of a palette image, only the 256 palette colors are looked up, so the palette
+        images written by another mapper or tool are remapped to the indices of color_map
+
+        Args:
+            index (np.ndarray): uint8 index plane.
+            palette (np.ndarray): RGB colors of the indices, shape=(256, 3).
+            color_map (ColorLUT or dict): {color: idx} or its table, in color_space.
+            color_space (str): color space of color_map.
+            require_color_in_mapper (bool): raise ValueError if the used colors are not in color_map.
+        """
+        assert color_space in ['BGR', 'RGB'], f'color_space must be in ["BGR", "RGB"], {color_space} is given'
+        colors = np.ascontiguousarray(palette if color_space == 'RGB' else palette[:, ::-1])
+        remap = ColorLUT.get(color_map)(colors[None], require_color_in_mapper=False)[0]
+        if np.array_equal(remap, np.arange(256, dtype=np.uint8)):
+            mask_id = index
+        else:
+            mask_id = np.take(remap, index)
+        if require_color_in_mapper and np.any(mask_id == ColorLUT.UNKNOWN):
+            raise ValueError('img has some colors not in color_map!')
+        return mask_id
+
+    @staticmethod
+    def id_cache_path(src: str, color_map: Union[ColorLUT, dict], cache_dir: Optional[str] = None) -> str:
+        """ Path of the cached id-mask of src under the color map, unique to the absolute path of src. """
+        src = osp.abspath(src)
+        name = f'{osp.splitext(osp.basename(src))[0]}_{md5(src.encode()).hexdigest()[:12]}'
+        return osp.join(ImageConvertor.id_cache_dir if cache_dir is None else cache_dir,
+                        ColorLUT.get(color_map).fingerprint,
+                        f'{name}.png')
+
+    @staticmethod
+    def load_id_mask(src: str,
+                     color_map: Union[ColorLUT, dict],
+                     require_color_in_mapper: bool = True,
+                     cache_dir: Optional[str] = None) -> np.ndarray:
+        """
+        Load the id-mask of the color mask src, from the cache if it is not older than src, otherwise the color mask
+        is converted by color2idx and the cache is generated. The cache of another color map is never used.
+        The index plane of a palette PNG is read directly without any cache.
+
+        Args:
+            src (str): path of the color mask, in the color space of color_map.
+            color_map (ColorLUT or dict): {color: idx} or its table.
+            require_color_in_mapper (bool): raise ValueError if the mask has colors not in color_map.
+            cache_dir (str, optional): root of the cache, "id_cache_dir" by default.
+        """
+        palette = read_palette_png(src)
+        if palette is not None:
+            return ImageConvertor.palette2idx(*palette, color_map, require_color_in_mapper=require_color_in_mapper)
+
+        cache_path = ImageConvertor.id_cache_path(src, color_map, cache_dir=cache_dir)
+        if osp.isfile(cache_path) and os.stat(cache_path).st_mtime_ns >= os.stat(src).st_mtime_ns:
+            mask_id = cv2.imread(cache_path, cv2.IMREAD_UNCHANGED)
+            if mask_id is not None:
+                if require_color_in_mapper and np.any(mask_id == ColorLUT.UNKNOWN):
+                    raise ValueError('img has some colors not in color_map!')
+                return mask_id
+
+        img = cv2.imread(src, cv2.IMREAD_COLOR)
+        assert img is not None, f'Failed to read {src}'
+        mask_id = ImageConvertor.color2idx(img, color_map, require_color_in_mapper)
+        # the cache is best-effort, a read-only or full cache directory must not break the load
+        tmp_path = f'{cache_path}.{os.getpid()}.png'
+        try:
+            os.makedirs(osp.dirname(cache_path), exist_ok=True)
+            if cv2.imwrite(tmp_path, mask_id):
+                os.replace(tmp_path, cache_path)
+            elif osp.exists(tmp_path):
+                os.remove(tmp_path)
+        except (OSError, cv2.error):
+            if osp.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        return mask_id
 
     def __getitem__(self, item):
         img = self.data['image'][item]
@@ -65,21 +522,45 @@ class ImageConvertor:
     def __len__(self):
         return self.data.total_num
 
-    def convert(self, batch_size=6, num_workers=6):
-        import torch
-        from torch.utils.data import Dataset
+    def convert(self,
+                num_workers: int = 6,
+                num_threads: int = 4,
+                chunk_size: int = 16,
+                overwrite: bool = False,
+                review: bool = True,
+                palette: bool = False,
+                suffix: str = 'id') -> ConversionReport:
+        """
+        Convert the masks to id-masks ("Id" images) with ConversionPipeline, the compiled table of the color map
+        is shared with the workers, the id-masks not older than their masks are skipped unless overwrite is True
 
-
-        class Temp(Dataset, type(self)):
-            def __getitem__(self, item):
-                return super(Temp, self).__getitem__(item)
-
-
-        temp_dataset = Temp(data=self.data, color_map=self.color_mapper)
-        dataloader = torch.utils.data.DataLoader(temp_dataset,
-                                                 batch_size=batch_size,
-                                                 shuffle=False,
-                                                 num_workers=num_workers)
-        pbar = tqdm([i for i in range(self.data.total_num // batch_size)])
-        for _ in dataloader:
-            pbar.update(1)
\ No newline at end of file
+        With palette=True the id-masks are written as palette PNGs colored by the color map, which look like the
+        color masks and are read without conversion, suffix="mask" converts the masks in place, which is only
+        allowed with palette=True, as the colors of a grayscale id-mask are lost. The id-masks written with another
+        version of the color map are converted again, see the fingerprint of ConversionPipeline
+        """
+        assert palette or suffix != 'mask', \
+            'Converting the masks in place (suffix="mask") destroys their colors, use palette=True or another suffix'
+        lut = ColorLUT.get(self.color_mapper)
+        shared = num_workers is not None and num_workers > 1
+        if shared:
+            # every run shares its own block, concurrent runs would close the block of the cached table
+            lut = lut.copy()
+            lut.share()
+        pipeline = ConversionPipeline(transform=partial(ImageConvertor.color2idx, color_map=lut),
+                                      imread_flag=cv2.IMREAD_COLOR,
+                                      num_workers=num_workers,
+                                      num_threads=num_threads,
+                                      chunk_size=chunk_size,
+                                      overwrite=overwrite,
+                                      writer=partial(write_palette_png, palette=self.get_palette(self.color_mapper))
+                                      if palette else cv2.imwrite,
+                                      fingerprint=f'{lut.fingerprint}-{"palette" if palette else "gray"}')
+        pairs = [(img.get_renamed_path('png', 'mask'), img.get_renamed_path('png', suffix)) for img in self.data['image']]
+        # the id-masks of the images outside "Cur" folders would overwrite the images themselves
+        pairs = [(src, dst) for (src, dst), img in zip(pairs, self.data['image']) if dst != img.cur_path]
+        try:
+            return pipeline.run(pairs, review=review)
+        finally:
+            if shared:
+                lut.close()
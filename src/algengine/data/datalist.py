@@ -1,12 +1,19 @@
 import os
+import gzip
 import json
+import pickle
+import concurrent.futures
 import numpy as np
+from hashlib import md5
+from tqdm import tqdm
 from functools import wraps
-from inspect import isfunction
-from collections import defaultdict
-from typing import Optional, Dict, List, Union, Tuple, Callable, NoReturn
+from itertools import repeat
+from inspect import isfunction, signature
+from collections import defaultdict, Counter
+from typing import Optional, Dict, List, Union, Tuple, Callable, NoReturn, Iterator, BinaryIO
 
 from .patch import DataPatch
+from .cluster import DataCluster
 from .container import DataContainer
 from .image import ImageData, SingleImage
 from ..utils import PathFormatter, ActionRecorder, is_not_none
@@ -17,7 +24,19 @@ class DataListGenerator(object):
     __slots__ = ['save_path', 'sep', 'target_model', 'include_null_path', 'label_exceptions', 'positive_labels',
                  'top_labels', 'merge_labels', '_raw_datasets', '_top_label_weights', 'exception_by_class',
                  'clean_labels', 'allow_duplicates', 'dataset_exceptions', 'removal', 'required', 'allow_empty',
-                 'ignore_ref', 'ignore_gerb', 'require_all', 'separated', 'skip_cur_check', '_record_actions', '_recorder']
+                 'ignore_ref', 'ignore_gerb', 'require_all', 'separated', 'skip_cur_check', '_record_actions', '_recorder',
+                 '_split_cache']
+
+    # columns of a datalist row for each target_model
+    ROW_FIELDS = {
+        ('cls', 'defect_cls'): ('cur', 'label', 'mask'),
+        ('cls_outer',): ('cur', 'label', 'binary_label'),
+        ('seg', 'seg_withref', 'seg_noref', 'withref'): ('cur', 'mask'),
+        ('comp_seg', 'compseg'): ('cur',),
+        ('zone_cls',): ('cur', 'label'),
+        ('sk',): ('cur', 'gerb', 'mask'),
+    }
+    WRITE_BUFFER_SIZE = 1 << 22
 
     def __init__(self,
                  save_path: Optional[str] = None,
@@ -44,6 +63,7 @@ class DataListGenerator(object):
         if save_path is not None:
             self.save_path = PathFormatter.format(save_path)
 
+        self._split_cache = None
         self.set_top_labels(top_labels)
         self.set_merge_labels(merge_labels)
         self.set_label_exceptions(label_exceptions)
@@ -78,6 +98,10 @@ class DataListGenerator(object):
     def raw_datasets(self) -> List[DataPatch]:
         return self._raw_datasets
 
+    @property
+    def recorder(self) -> ActionRecorder:
+        return self._recorder
+
     @property
     def merged_dataset(self) -> DataContainer:
         train, _ = self._split(split_ratio=1)
@@ -86,16 +110,17 @@ class DataListGenerator(object):
     @property
     def dataset(self) -> DataContainer:
         dataset = DataContainer(allow_duplicates=True)
-        for data_patch in self.raw_datasets:
-            dataset += data_patch.raw_cluster_data
-        return dataset
+        return dataset.merge_from(*(data_patch.raw_cluster_data for data_patch in self.raw_datasets))
+
+    def _record_action(self, action: str, args: Tuple, kwargs: Dict) -> NoReturn:
+        # the set_* calls of __init__ come before the recorder, they are covered by the constructor arguments
+        if getattr(self, '_record_actions', False):
+            self._recorder.record(action, args, kwargs)
 
     def record(fn):
         @wraps(fn)
         def wrapped_fn(self, *args, **kwargs):
-            if self._record_actions:
-                self._recorder.actions[fn.__name__].args.append(args)
-                self._recorder.actions[fn.__name__].kwargs.append(kwargs)
+            self._record_action(fn.__name__, args=args, kwargs=kwargs)
             return fn(self, *args, **kwargs)
 
         return wrapped_fn
@@ -131,22 +156,23 @@ class DataListGenerator(object):
 
         return cls(save_path=save_path, **config)
 
-    @record
-    def load_dataset(self,
-                     folder_path: str,
-                     num_workers: int = 8,
-                     force_load: bool = False,
-                     separated: Optional[bool] = None,
-                     exceptions: Optional[List] = None,
-                     ignore_ref: Optional[bool] = None,
-                     ignore_gerb: Optional[bool] = None,
-                     require_all: Optional[bool] = None,
-                     clean_labels: Optional[bool] = None,
-                     skip_cur_check: Optional[bool] = None,
-                     required: Union[List, str, None] = None,
-                     exception_by_class: Optional[bool] = None,
-                     duplicates: Union[Dict, int, None] = None,
-                     hard_samples: Union[List, bool, None] = None,):
+    def _create_dataset(self,
+                        folder_path: str,
+                        num_workers: int = 8,
+                        force_load: bool = False,
+                        separated: Optional[bool] = None,
+                        exceptions: Optional[List] = None,
+                        ignore_ref: Optional[bool] = None,
+                        ignore_gerb: Optional[bool] = None,
+                        require_all: Optional[bool] = None,
+                        clean_labels: Optional[bool] = None,
+                        skip_cur_check: Optional[bool] = None,
+                        required: Union[List, str, None] = None,
+                        exception_by_class: Optional[bool] = None,
+                        duplicates: Union[Dict, int, None] = None,
+                        hard_samples: Union[List, bool, None] = None,
+                        lazy: bool = False,
+                        auto_load: bool = True) -> DataPatch:
 
         assert (not self.allow_duplicates and duplicates is None) or self.allow_duplicates, \
             'Duplication of datasets is not allowed!'
@@ -166,24 +192,64 @@ class DataListGenerator(object):
         if force_load:
             dataset_exception = None if exceptions is None else exceptions
 
-        dataset = DataPatch(path=folder_path,
-                            sort_raw_data=False,
-                            separated=separated,
-                            duplicates=duplicates,
-                            ignore_ref=ignore_ref,
-                            ignore_gerb=ignore_gerb,
-                            skip_cur_check=skip_cur_check,
-                            num_workers=num_workers,
-                            hard_samples=hard_samples,
-                            required=required_attr,
-                            require_all=require_all,
-                            clean_labels=clean_labels,
-                            exceptions=dataset_exception,
-                            exception_by_class=exception_by_class,)
-
-        assert not dataset.is_empty() or self.allow_empty, 'Empty Dataset: ' + folder_path
+        return DataPatch(path=folder_path,
+                         sort_raw_data=False,
+                         separated=separated,
+                         duplicates=duplicates,
+                         ignore_ref=ignore_ref,
+                         ignore_gerb=ignore_gerb,
+                         skip_cur_check=skip_cur_check,
+                         num_workers=num_workers,
+                         hard_samples=hard_samples,
+                         required=required_attr,
+                         require_all=require_all,
+                         clean_labels=clean_labels,
+                         exceptions=dataset_exception,
+                         exception_by_class=exception_by_class,
+                         lazy=lazy,
+                         auto_load=auto_load,)
+
+    def _append_dataset(self, dataset: DataPatch) -> NoReturn:
+        assert not (dataset.is_loaded and dataset.is_empty()) or self.allow_empty, 'Empty Dataset: ' + dataset.root
         self._raw_datasets.append(dataset)
 
+    @record
+    def load_dataset(self,
+                     folder_path: str,
+                     num_workers: int = 8,
+                     force_load: bool = False,
+                     separated: Optional[bool] = None,
+                     exceptions: Optional[List] = None,
+                     ignore_ref: Optional[bool] = None,
+                     ignore_gerb: Optional[bool] = None,
+                     require_all: Optional[bool] = None,
+                     clean_labels: Optional[bool] = None,
+                     skip_cur_check: Optional[bool] = None,
+                     required: Union[List, str, None] = None,
+                     exception_by_class: Optional[bool] = None,
+                     duplicates: Union[Dict, int, None] = None,
+                     hard_samples: Union[List, bool, None] = None,
+                     lazy: bool = False,
+                     defer_load: bool = False,):
+
+        dataset = self._create_dataset(folder_path=folder_path,
+                                       num_workers=num_workers,
+                                       force_load=force_load,
+                                       separated=separated,
+                                       exceptions=exceptions,
+                                       ignore_ref=ignore_ref,
+                                       ignore_gerb=ignore_gerb,
+                                       require_all=require_all,
+                                       clean_labels=clean_labels,
+                                       skip_cur_check=skip_cur_check,
+                                       required=required,
+                                       exception_by_class=exception_by_class,
+                                       duplicates=duplicates,
+                                       hard_samples=hard_samples,
+                                       lazy=lazy,
+                                       auto_load=not defer_load,)
+        self._append_dataset(dataset)
+
     def load_from(self,
                   root_dir: str,
                   num_workders=8,
@@ -199,14 +265,28 @@ class DataListGenerator(object):
                   exceptions: Optional[List] = None,
                   duplicates: Union[Dict, int, None] = None,
                   hard_samples: Optional[Dict] = None,
-                  exception_by_class: Optional[Dict] = None,) -> NoReturn:
+                  exception_by_class: Optional[Dict] = None,
+                  lazy: bool = False,
+                  use_process_pool: bool = True,
+                  defer_load: bool = False,) -> NoReturn:
+        """
+        Load all the datasets under root_dir.
+
+        With use_process_pool (the default) and num_workders > 1, the clusters of all the datasets are loaded in one
+        shared process pool of num_workders processes, otherwise the datasets are loaded one by one with
+        num_workders threads each.
+        The order of the loaded datasets follows the listing of root_dir either way.
+        With defer_load, the datasets are only loaded when their data is first accessed,
+        e.g. by "regenerate_datalists" for the datasets that have changed.
+        """
 
         root_dir = PathFormatter.format(root_dir)
 
         datasets = self.find_datasets(root_dir) if search_tree \
-            else [os.path.join(root_dir, dataset) for dataset in os.listdir(root_dir)]
+            else [os.path.join(root_dir, dataset) for dataset in sorted(os.listdir(root_dir))]
 
         exceptions = self.dataset_exceptions if exceptions is None else exceptions
+        dataset_kwargs = []
         for dataset in datasets:
             dataset_name = os.path.basename(dataset)
 
@@ -232,20 +312,117 @@ class DataListGenerator(object):
                 if exception_by_class is not None and dataset_name in exception_by_class \
                 else self.exception_by_class
 
-            self.load_dataset(dataset,
-                              num_workers=num_workders,
-                              force_load=force_load,
-                              separated=separated,
-                              ignore_ref=ignore_ref,
-                              ignore_gerb=ignore_gerb,
-                              skip_cur_check=skip_cur_check,
-                              require_all=require_all,
-                              clean_labels=clean_labels,
-                              duplicates=multi,
-                              hard_samples=use_split,
-                              required=required_attr,
-                              exceptions=self.label_exceptions,
-                              exception_by_class=dataset_exception_by_class,)
+            dataset_kwargs.append(dict(folder_path=dataset,
+                                       num_workers=num_workders,
+                                       force_load=force_load,
+                                       separated=separated,
+                                       ignore_ref=ignore_ref,
+                                       ignore_gerb=ignore_gerb,
+                                       skip_cur_check=skip_cur_check,
+                                       require_all=require_all,
+                                       clean_labels=clean_labels,
+                                       duplicates=multi,
+                                       hard_samples=use_split,
+                                       required=required_attr,
+                                       exceptions=self.label_exceptions,
+                                       exception_by_class=dataset_exception_by_class,
+                                       lazy=lazy,))
+
+        if defer_load or not use_process_pool or num_workders is None or num_workders <= 1:
+            for kwargs in dataset_kwargs:
+                self.load_dataset(defer_load=defer_load, **kwargs)
+            return
+
+        patches = [self._create_dataset(auto_load=False, **kwargs) for kwargs in dataset_kwargs]
+        tasks = [patch.cluster_tasks() for patch in patches]
+        results = [[None] * len(patch_tasks) for patch_tasks in tasks]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workders) as exe, \
+                tqdm(total=sum(len(patch_tasks) for patch_tasks in tasks)) as pbar:
+            futures = {exe.submit(DataCluster.from_path, **task): (i, j)
+                       for i, patch_tasks in enumerate(tasks)
+                       for j, task in enumerate(patch_tasks)}
+            for future in concurrent.futures.as_completed(futures):
+                i, j = futures[future]
+                results[i][j] = future.result()
+                pbar.update()
+
+        for kwargs, patch, clusters in zip(dataset_kwargs, patches, results):
+            patch.set_clusters(clusters)
+            self._record_action('load_dataset', args=(), kwargs=kwargs)
+            self._append_dataset(patch)
+
+    def _load_step_key(self, args: Tuple, kwargs: Dict) -> str:
+        """ Fingerprint of the inputs of a recorded "load_dataset": its arguments, the configurations of the
+        generator it falls back to and the fingerprint of the dataset directory. """
+        bound = signature(DataListGenerator.load_dataset).bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments.pop('self')
+        arguments['folder_path'] = PathFormatter.format(arguments['folder_path'])
+        config = dict(separated=self.separated,
+                      required=self.required,
+                      ignore_ref=self.ignore_ref,
+                      ignore_gerb=self.ignore_gerb,
+                      require_all=self.require_all,
+                      clean_labels=self.clean_labels,
+                      skip_cur_check=self.skip_cur_check,
+                      label_exceptions=self.label_exceptions,
+                      allow_duplicates=self.allow_duplicates,
+                      exception_by_class=self.exception_by_class)
+        hash_calc = md5(json.dumps([arguments, config], sort_keys=True, default=str).encode())
+        hash_calc.update(DataPatch.fingerprint_of(arguments['folder_path']).encode())
+        return hash_calc.hexdigest()
+
+    def replay(self,
+               recorder: Union[ActionRecorder, str],
+               cache_file: Optional[str] = None,
+               review: bool = True) -> Dict[str, int]:
+        """
+        Replay the recorded actions (an ActionRecorder or a file written by "ActionRecorder.dump") in order.
+
+        With cache_file, the loaded datasets are snapshotted after the replay together with the fingerprints
+        of their inputs (see "_load_step_key"), and the "load_dataset" steps whose inputs have not changed
+        are restored from the snapshots on the next replay instead of scanning the dataset again.
+
+        Returns:
+            Dict[str, int]: number of the "replayed" and "restored" steps.
+        """
+        if isinstance(recorder, str):
+            recorder = ActionRecorder.load(recorder)
+        assert issubclass(recorder.obj_type, DataListGenerator), \
+            f'Cannot replay the actions of {recorder.obj_type} on DataListGenerator'
+
+        snapshots = dict()
+        if cache_file is not None and os.path.isfile(cache_file):
+            with open(cache_file, 'rb') as f:
+                snapshots = pickle.load(f)
+
+        used_snapshots = dict()
+        counts = dict(replayed=0, restored=0)
+        for action, args, kwargs in recorder.steps():
+            key = self._load_step_key(args, kwargs) if action == 'load_dataset' and cache_file is not None else None
+            if key is not None and key in snapshots:
+                dataset = snapshots[key]
+                # cached containers are keyed by the ids of the clusters, which do not survive pickling
+                dataset.invalidate()
+                self._record_action(action, args=args, kwargs=kwargs)
+                self._append_dataset(dataset)
+                counts['restored'] += 1
+            else:
+                getattr(self, action)(*args, **kwargs)
+                counts['replayed'] += 1
+            if key is not None:
+                used_snapshots[key] = self.raw_datasets[-1]
+
+        if cache_file is not None:
+            temp_file = cache_file + '.tmp'
+            with open(temp_file, 'wb') as f:
+                pickle.dump(used_snapshots, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, cache_file)
+
+        if review:
+            print('Replayed: %d step(s), restored %d dataset(s) from cache' % (counts['replayed'], counts['restored']))
+        return counts
 
     def get_top_label_weights(self,
                               dataset: Optional[DataContainer] = None,
@@ -354,8 +531,8 @@ class DataListGenerator(object):
     #                 for key in set(train.keys()) - set(val.keys()):
     #                     val[key] = list(set(train[key]))
     #             train_file_name, val_file_name = self.CONFIG['default_gen_files'][gen_mode]
-    #             self.__write_datalist(dataset=train, name=train_file_name, suffix=suffix, review=review, addup=addup_file)
-    #             self.__write_datalist(dataset=val, name=val_file_name, suffix=suffix, review=review)
+    #             self._write_datalist(dataset=train, name=train_file_name, suffix=suffix, review=review, addup=addup_file)
+    #             self._write_datalist(dataset=val, name=val_file_name, suffix=suffix, review=review)
     #         else:
     #             train, _ = self._split(split_ratio=1)
     #             if num_condition is not None:
@@ -365,7 +542,7 @@ class DataListGenerator(object):
     #             elif is_not_none(limit_num_ratio):
     #                 train = train.limit_num_ratio(limit_num_ratio)
     #             file_name = self.CONFIG['default_gen_files'][gen_mode]
-    #             self.__write_datalist(dataset=train, name=file_name, suffix=suffix, review=review, addup=addup_file)
+    #             self._write_datalist(dataset=train, name=file_name, suffix=suffix, review=review, addup=addup_file)
 
     #         _ = self.get_top_label_weights(dataset=train)
     #         if export_datset_info:
@@ -382,69 +559,335 @@ class DataListGenerator(object):
         self.removal = targets
         # TODO: remove not supported
 
-    def _split(self, split_ratio: float = 0.8, random_seed: int = 42) -> Tuple[DataContainer, DataContainer]:
+    def _split_key(self,
+                   split_ratio: float,
+                   random_seed: int,
+                   split_mode: str,
+                   hash_by: str) -> Tuple:
+        def freeze(obj):
+            if isinstance(obj, dict):
+                return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+            if isinstance(obj, (list, tuple, set)):
+                return tuple(freeze(item) for item in obj)
+            return obj
+
+        return (split_ratio, random_seed, split_mode, hash_by, self.allow_duplicates,
+                freeze(self.merge_labels), freeze(self.top_labels),
+                freeze(self.label_exceptions), freeze(self.dataset_exceptions),
+                tuple((id(data_patch), data_patch.version, tuple(len(cluster) for cluster in data_patch.raw_data))
+                      for data_patch in self.raw_datasets))
+
+    def clear_split_cache(self) -> NoReturn:
+        self._split_cache = None
+
+    def _split_patches(self,
+                       patches: List[DataPatch],
+                       split_ratio: float = 0.8,
+                       random_seed: int = 42,
+                       split_mode: str = 'shuffle',
+                       hash_by: str = 'name') -> Tuple[DataContainer, DataContainer]:
         train = DataContainer(allow_duplicates=self.allow_duplicates)
         val = DataContainer(allow_duplicates=self.allow_duplicates)
 
-        for data_patch in self.raw_datasets:
+        for data_patch in patches:
             temp_train, temp_val = data_patch.split(split_ratio=split_ratio,
                                                     merge_labels=self.merge_labels,
                                                     top_labels=self.top_labels,
-                                                    random_seed=random_seed)
-            train += temp_train
-            val += temp_val
-
+                                                    random_seed=random_seed,
+                                                    split_mode=split_mode,
+                                                    hash_by=hash_by)
+            train.merge_from(temp_train)
+            val.merge_from(temp_val)
         return train, val
 
+    def _split(self,
+               split_ratio: float = 0.8,
+               random_seed: int = 42,
+               split_mode: str = 'shuffle',
+               hash_by: str = 'name') -> Tuple[DataContainer, DataContainer]:
+        """
+        Split all the datasets, the result is memoized until the split arguments, the "set_*" configurations
+        or the loaded datasets change. Copies of the memoized containers are returned.
+        """
+        key = self._split_key(split_ratio=split_ratio, random_seed=random_seed, split_mode=split_mode, hash_by=hash_by)
+        if self._split_cache is None or self._split_cache[0] != key:
+            train, val = self._split_patches(self.raw_datasets,
+                                             split_ratio=split_ratio,
+                                             random_seed=random_seed,
+                                             split_mode=split_mode,
+                                             hash_by=hash_by)
+            self._split_cache = (key, train, val)
+
+        _, train, val = self._split_cache
+        return (DataContainer(allow_duplicates=train.allow_duplicates, **{k: list(v) for k, v in train.items()}),
+                DataContainer(allow_duplicates=val.allow_duplicates, **{k: list(v) for k, v in val.items()}))
+
     def get_binary_label(self, label: str) -> str:
         return 'OK' if label in self.positive_labels else 'NG'
 
-    def __write_datalist(self,
-                         dataset: DataContainer,
-                         name: str = 'train',
-                         suffix: Optional[str] = None,
-                         review: bool = True,
-                         addup: Optional[str] = None) -> NoReturn:
+    def _get_row_fields(self) -> Tuple[str, ...]:
+        for target_models, fields in self.ROW_FIELDS.items():
+            if self.target_model in target_models:
+                return fields
+        raise NotImplementedError(f'Unknown target_model: {self.target_model}')
+
+    @staticmethod
+    def _resolve_attr_paths(images: List[ImageData],
+                            attr: str,
+                            include_null_path: bool = False) -> List[str]:
+        """
+        Resolve the attribute paths of the images in bulk, every attribute directory is listed once
+        instead of checking every attribute file with a stat.
+        """
+        listing = dict()
+        paths = []
+        for img_data in images:
+            path = img_data.get_renamed_path(ext='png', suffix=attr)
+            root, name = os.path.split(path)
+            if root not in listing:
+                listing[root] = set(os.listdir(root)) if os.path.isdir(root) else set()
+            if name in listing[root]:
+                paths.append(path)
+            elif include_null_path:
+                paths.append('null')
+            else:
+                raise FileNotFoundError(f'The {attr} file of {img_data} is missing!')
+        return paths
+
+    def _format_rows(self,
+                     label: str,
+                     images: List[ImageData],
+                     fields: Tuple[str, ...]) -> Iterator[str]:
+        columns = []
+        for field in fields:
+            if field == 'cur':
+                columns.append([img_data.cur_path for img_data in images])
+            elif field == 'label':
+                columns.append(repeat(label))
+            elif field == 'binary_label':
+                columns.append(repeat(self.get_binary_label(label)))
+            else:
+                columns.append(self._resolve_attr_paths(images, field, include_null_path=self.include_null_path))
+        return map(self.sep.join, zip(*columns))
+
+    @staticmethod
+    def _open_datalist(output_file: str, compression: Optional[str] = None) -> Tuple[str, BinaryIO]:
+        if compression is None:
+            return output_file, open(output_file, 'wb', buffering=DataListGenerator.WRITE_BUFFER_SIZE)
+        if compression in ['gz', 'gzip']:
+            output_file += '.gz'
+            return output_file, gzip.open(output_file, 'wb', compresslevel=6)
+        if compression in ['zst', 'zstd']:
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('Package "zstandard" is required for "zst" datalists: pip install zstandard')
+            output_file += '.zst'
+            return output_file, zstandard.ZstdCompressor().stream_writer(open(output_file, 'wb'))
+        raise NotImplementedError(f'Unknown compression: {compression}, should be None, "gz" or "zst"')
+
+    def _iter_lines(self, dataset: DataContainer) -> Iterator[bytes]:
+        fields = self._get_row_fields()
+        for label, data in dataset.items():
+            for row in self._format_rows(label=label, images=data, fields=fields):
+                yield (row + '\n').encode()
+
+    def _write_datalist(self,
+                        dataset: DataContainer,
+                        name: str = 'train',
+                        suffix: Optional[str] = None,
+                        review: bool = True,
+                        addup: Optional[str] = None,
+                        compression: Optional[str] = None,
+                        with_index: bool = False) -> str:
         suffix = self.format_suffix(suffix)
-        output_file = os.path.join(self.save_path, name + suffix + '.txt')
-        with open(output_file, 'w') as f:
-            for label, data in dataset.items():
-                for img_data in data:
-                    mask = self.get_or_null(img_data, 'mask', include_null_path=self.include_null_path)
-                    cur = img_data.cur
-                    if self.target_model in ['cls', 'defect_cls']:
-                        write_list = [cur, label, mask]
-                        line = self.sep.join(write_list) + '\n'
-                        f.write(line)
-                    elif self.target_model in ['cls_outer']:
-                        binary_label = self.get_binary_label(label)
-                        write_list = [cur, label, binary_label]
-                        line = self.sep.join(write_list) + '\n'
-                        f.write(line)
-                    elif self.target_model in ['seg', 'seg_withref', 'seg_noref', 'withref']:
-                        write_list = [cur, mask]
-                        line = self.sep.join(write_list) + '\n'
-                        f.write(line)
-                    elif self.target_model in ['comp_seg', 'compseg']:
-                        line = cur + '\n'
-                        f.write(line)
-                    elif self.target_model in ['zone_cls']:
-                        write_list = [cur, label]
-                        line = self.sep.join(write_list) + '\n'
-                        f.write(line)
-                    elif self.target_model in ['sk']:
-                        gerb = self.get_or_null(img_data, 'gerb', include_null_path=self.include_null_path)
-                        write_list = [cur, gerb, mask]
-                        line = self.sep.join(write_list) + '\n'
-                        f.write(line)
+        output_file, f = self._open_datalist(os.path.join(self.save_path, name + suffix + '.txt'), compression)
+        line_sizes = []
+        with f:
+            chunk, chunk_size = [], 0
+            for line in self._iter_lines(dataset):
+                chunk.append(line)
+                chunk_size += len(line)
+                if chunk_size >= self.WRITE_BUFFER_SIZE:
+                    f.write(b''.join(chunk))
+                    if with_index:
+                        line_sizes.extend(map(len, chunk))
+                    chunk, chunk_size = [], 0
             if addup is not None:
-                with open(addup, 'r') as add_file:
-                    add_lines = add_file.readlines()
-                f.writelines(add_lines)
+                with open(addup, 'rb') as add_file:
+                    chunk.extend(add_file.readlines())
+            f.write(b''.join(chunk))
+            if with_index:
+                line_sizes.extend(map(len, chunk))
+
+        if with_index:
+            # byte offsets of the lines in the uncompressed datalist, the last one is the total size
+            offsets = np.zeros(len(line_sizes) + 1, dtype=np.uint64)
+            np.cumsum(line_sizes, out=offsets[1:])
+            offsets.tofile(os.path.join(self.save_path, name + suffix + '.idx'))
 
         if review:
             print('Generated: %s' % output_file)
-
+        return output_file
+
+    def write_datalists(self,
+                        datasets: Dict[str, DataContainer],
+                        suffix: Optional[str] = None,
+                        review: bool = True,
+                        addup: Optional[Dict[str, str]] = None,
+                        compression: Optional[str] = None,
+                        with_index: bool = False,
+                        num_workers: Optional[int] = None) -> Dict[str, str]:
+        """
+        Write the datalists, e.g. {'train': train, 'val': val}, concurrently.
+
+        Args:
+            datasets (Dict[str, DataContainer]): name of the datalist and its data.
+            suffix (str, optional): suffix of the datalist file names.
+            review (bool): whether to print the generated files.
+            addup (Dict[str, str], optional): name of the datalist and the file to be appended to it.
+            compression (str, optional): None, "gz" or "zst".
+            with_index (bool): whether to write the line offsets as uint64 to "{name}{suffix}.idx".
+            num_workers (int, optional): number of writer threads, one for each datalist by default.
+
+        Returns:
+            Dict[str, str]: name of the datalist and the file written.
+        """
+        assert getattr(self, 'save_path', None) is not None, 'Save Path is not given!'
+        os.makedirs(self.save_path, exist_ok=True)
+        addup = dict() if addup is None else addup
+        num_workers = len(datasets) if num_workers is None else num_workers
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(num_workers, 1)) as exe:
+            futures = {name: exe.submit(self._write_datalist,
+                                        dataset=dataset,
+                                        name=name,
+                                        suffix=suffix,
+                                        review=review,
+                                        addup=addup.get(name),
+                                        compression=compression,
+                                        with_index=with_index)
+                       for name, dataset in datasets.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def _manifest_options(self,
+                          split_ratio: float,
+                          random_seed: int,
+                          split_mode: str,
+                          hash_by: str) -> str:
+        return json.dumps(dict(split_ratio=split_ratio,
+                               random_seed=random_seed,
+                               split_mode=split_mode,
+                               hash_by=hash_by,
+                               target_model=self.target_model,
+                               sep=self.sep,
+                               include_null_path=self.include_null_path,
+                               merge_labels=self.merge_labels,
+                               top_labels=self.top_labels,
+                               positive_labels=self.positive_labels,
+                               label_exceptions=self.label_exceptions,
+                               allow_duplicates=self.allow_duplicates), sort_keys=True, default=str)
+
+    def regenerate_datalists(self,
+                             split_ratio: float = 0.8,
+                             random_seed: int = 42,
+                             split_mode: str = 'hash',
+                             hash_by: str = 'name',
+                             suffix: Optional[str] = None,
+                             review: bool = True) -> Dict[str, Dict[str, List[str]]]:
+        """
+        Regenerate the train/val datalists in save_path, only re-splitting the datasets that have changed
+        since the last generation, which is recorded in "datalist_manifest{suffix}.json" with the fingerprints
+        of the dataset directories (see "DataPatch.fingerprint").
+
+        The lines of the changed and removed datasets are diffed against the existing datalists: new lines are
+        appended in place when nothing is removed, otherwise the datalist is rewritten atomically.
+        Everything is regenerated when there is no manifest, the options have changed or a datalist is missing.
+        Load the datasets with defer_load=True to skip loading the unchanged ones.
+        The incremental update needs split_mode="hash", which keeps the split of the existing images stable as
+        the datasets grow, and the new lines are deduplicated against the kept ones unless duplicates are allowed.
+
+        Returns:
+            Dict[str, Dict[str, List[str]]]: name of the datalist and its "added" and "removed" lines.
+        """
+        assert getattr(self, 'save_path', None) is not None, 'Save Path is not given!'
+        os.makedirs(self.save_path, exist_ok=True)
+        names = ('train', 'val')
+        formatted_suffix = self.format_suffix(suffix)
+        manifest_file = os.path.join(self.save_path, 'datalist_manifest' + formatted_suffix + '.json')
+        datalist_files = {name: os.path.join(self.save_path, name + formatted_suffix + '.txt') for name in names}
+
+        options = self._manifest_options(split_ratio=split_ratio,
+                                         random_seed=random_seed,
+                                         split_mode=split_mode,
+                                         hash_by=hash_by)
+        sources = {data_patch.root: data_patch.fingerprint() for data_patch in self.raw_datasets}
+
+        manifest = None
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+
+        if manifest is None or manifest.get('options') != options \
+                or not all(os.path.isfile(file) for file in datalist_files.values()):
+            train, val = self._split(split_ratio=split_ratio,
+                                     random_seed=random_seed,
+                                     split_mode=split_mode,
+                                     hash_by=hash_by)
+            datasets = dict(zip(names, (train, val)))
+            self.write_datalists(datasets, suffix=suffix, review=review)
+            diff = {name: dict(added=[line.decode() for line in self._iter_lines(dataset)], removed=[])
+                    for name, dataset in datasets.items()}
+        else:
+            assert split_mode == 'hash', \
+                f'Incremental regeneration needs split_mode="hash" to keep the split stable, {split_mode} is given'
+            changed = [data_patch for data_patch in self.raw_datasets
+                       if manifest['sources'].get(data_patch.root) != sources[data_patch.root]]
+            stale_roots = tuple(os.path.join(root, '') for root in manifest['sources']
+                                if root not in sources or manifest['sources'][root] != sources[root])
+            datasets = dict(zip(names, self._split_patches(changed,
+                                                           split_ratio=split_ratio,
+                                                           random_seed=random_seed,
+                                                           split_mode=split_mode,
+                                                           hash_by=hash_by)))
+            diff = dict()
+            for name, dataset in datasets.items():
+                with open(datalist_files[name], 'rb') as f:
+                    old_lines = f.readlines()
+                stale = Counter(line for line in old_lines if line.decode().startswith(stale_roots))
+                fresh = Counter(self._iter_lines(dataset))
+                added, removed = fresh - stale, stale - fresh
+
+                # keep the order of the existing lines, drop the removed ones and append the new ones
+                to_remove = removed.copy()
+                kept = []
+                for line in old_lines:
+                    if to_remove[line] > 0:
+                        to_remove[line] -= 1
+                    else:
+                        kept.append(line)
+                if not self.allow_duplicates:
+                    # same as the deduplication of the merged containers in a full regeneration
+                    kept_lines = set(kept)
+                    added = Counter({line: count for line, count in added.items() if line not in kept_lines})
+
+                if not removed:
+                    with open(datalist_files[name], 'ab') as f:
+                        f.write(b''.join(added.elements()))
+                else:
+                    temp_file = datalist_files[name] + '.tmp'
+                    with open(temp_file, 'wb') as f:
+                        f.write(b''.join(kept))
+                        f.write(b''.join(added.elements()))
+                    os.replace(temp_file, datalist_files[name])
+
+                diff[name] = dict(added=[line.decode() for line in added.elements()],
+                                  removed=[line.decode() for line in removed.elements()])
+                if review:
+                    print('Updated: %s (+%d, -%d)' % (datalist_files[name], sum(added.values()), sum(removed.values())))
+
+        with open(manifest_file, 'w') as f:
+            json.dump(dict(options=options, sources=sources), f, indent=4)
+        return diff
 
     def _merge_label(self, label: str) -> str:
         return self.merge_labels[label] if self.merge_labels is not None else label
@@ -452,10 +895,11 @@ class DataListGenerator(object):
     def report_dataset_info(self,
                             split_ratio: float = 0.8,
                             count_attrs: Union[str, List[str], None] = None,
-                            ascending: bool = False) -> DataContainer:
+                            ascending: bool = False,
+                            split_mode: str = 'shuffle') -> DataContainer:
         if isinstance(count_attrs, str):
             count_attrs = [count_attrs]
-        train, _ = self._split(split_ratio=split_ratio)
+        train, _ = self._split(split_ratio=split_ratio, split_mode=split_mode)
         df = train.get_statistics(attrs=count_attrs, sort_by=DataContainer.NUM, ascending=ascending)
 
         print('Number of Classes:', len(train), '\n')
@@ -465,7 +909,7 @@ class DataListGenerator(object):
         print(df)
         return train
 
-    # @record
+    @record
     def set_label_exceptions(self,
                              label_exceptions: List,
                              fn: Optional[Callable] = None) -> NoReturn:
@@ -475,8 +919,9 @@ class DataListGenerator(object):
         if isfunction(fn):
             label_exceptions = fn(label_exceptions)
         setattr(self, 'label_exceptions', label_exceptions)
+        self.clear_split_cache()
 
-    # @record
+    @record
     def set_dataset_exceptions(self,
                                dataset_exceptions: List,
                                fn: Optional[Callable] = None) -> NoReturn:
@@ -485,8 +930,9 @@ class DataListGenerator(object):
         if isfunction(fn):
             dataset_exceptions = fn(dataset_exceptions)
         setattr(self, 'dataset_exceptions', dataset_exceptions)
+        self.clear_split_cache()
 
-    # @record
+    @record
     def set_merge_labels(self,
                          merge_labels: Dict,
                          fn: Optional[Callable] = None) -> NoReturn:
@@ -512,14 +958,16 @@ class DataListGenerator(object):
                         temp[label] = k
                 merge_labels = temp
         setattr(self, 'merge_labels', merge_labels)
+        self.clear_split_cache()
 
-    # @record
+    @record
     def set_top_labels(self,
                        top_labels: List,
                        fn: Callable = None) -> NoReturn:
         if isfunction(fn):
             top_labels = fn(top_labels)
         setattr(self, 'top_labels', top_labels)
+        self.clear_split_cache()
 
     @staticmethod
     def find_datasets(root_dir: str) -> List:
@@ -14,7 +14,7 @@ from hashlib import md5
 from functools import wraps
 from typing import Tuple, Callable, Optional
 
-from ..utils import PathFormatter, SuffixFormatter, convert2map, exists_or_make
+from ..utils import PathFormatter, SuffixFormatter, convert2map, exists_or_make, read_palette_png
 # from datatools.image.mappers import ClassMapper
 
 
@@ -143,6 +143,19 @@ class SingleImage:
             elif self._imread_flag == cv2.IMREAD_COLOR:
                 self._img_data = self._img_data.convert('RGB')
 
+    def read_palette(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """ Index plane and RGB palette of a palette-mode image without any color conversion, None otherwise. """
+        if SuffixFormatter.is_encrypted_format(self.name) or not osp.isfile(self.path):
+            return None
+        return read_palette_png(self.path)
+
+    @property
+    def is_palette(self) -> bool:
+        if SuffixFormatter.is_encrypted_format(self.name) or not osp.isfile(self.path):
+            return False
+        with Image.open(self.path) as image:
+            return image.mode == 'P'
+
     @property
     def path(self) -> str:
         return osp.join(self._root, self._name)
@@ -485,7 +498,8 @@ class ImageData:
                  require_mask: bool = False,
                  strict_inspection: bool = False,
                  hard_sample: bool = False,
-                 mark: str | None = None):
+                 mark: str | None = None,
+                 check_exists: bool = True):
         """ Load image and its auxiliary data.
 
 
@@ -531,19 +545,23 @@ class ImageData:
             require_mask (bool): Flag of requiring attribute 'mask' of the image.
             strict_inspection (bool): Flag of using md5 for checking duplicate images.
             hard_sample (bool): Flag of hard sample.
+            check_exists (bool): Flag of formatting the path and checking the file exists. Could be disabled
+                if file_path is a formatted path taken from a directory listing.
         """
 
         assert backend in ['cv2', 'pillow'], f'Backend must be either cv2 or pillow! {backend} is not allowed!'
-        
-        file_path = PathFormatter.format(file_path)
-        
+
         cur_folder = 'Cur'.join([os.sep, os.sep])
+        if check_exists:
+            file_path = PathFormatter.format(file_path)
+
         if separated is None:
             separated = cur_folder in file_path
-            
-        assert osp.exists(file_path) and osp.isfile(file_path), f"Image Does Not Exist! {file_path}"
-        assert separated == (cur_folder in file_path), f"Image Not Separated to 'Cur' folder: {file_path}" \
-            if separated else f"Image Already Separated to 'Cur' folder: {file_path}"
+
+        if check_exists:
+            assert osp.exists(file_path) and osp.isfile(file_path), f"Image Does Not Exist! {file_path}"
+            assert separated == (cur_folder in file_path), f"Image Not Separated to 'Cur' folder: {file_path}" \
+                if separated else f"Image Already Separated to 'Cur' folder: {file_path}"
 
         self.__mark = mark
         self.__label = None
@@ -579,6 +597,10 @@ class ImageData:
     def cur(self) -> SingleImage | str:
         return SingleImage(self._cur, backend=self.__backend, parent=self) if self.__use_single_image else self._cur
 
+    @property
+    def cur_path(self) -> str:
+        return self._cur
+
     @property
     def center(self) -> Tuple[int, int]:
         # [H, W]
@@ -220,6 +220,12 @@ class ClassMapper:
     def allowed_colors(self) -> List[Tuple[int, int, int]]:
         return [color for colors in self.code2color.values() for color in colors]
 
+    def get_lut(self, color_space: str = 'BGR'):
+        """ Compiled color lookup table of the current version of the mapper, see "ColorLUT". """
+        from .convertor import ColorLUT
+        assert color_space in ['BGR', 'RGB'], f'color_space must be in ["BGR", "RGB"], {color_space} is given'
+        return ColorLUT.get(getattr(self, f'{color_space.lower()}_to_idx'))
+
 
 FACEPARSE = ClassMapper('FACEPARSE')
 
@@ -1,11 +1,13 @@
 import os
 import concurrent.futures
+from hashlib import md5
 from functools import wraps
 from typing import Optional, List, Union, Dict, Tuple
 
 from .image import ImageData
 from .cluster import DataCluster
 from .container import DataContainer
+from .validator import DatasetValidator
 from ..utils import PathFormatter, SuffixFormatter, scandir
 
 
@@ -14,7 +16,8 @@ class DataPatch(object):
                  '_separated', '_duplicates', '_exceptions', '_use_single_img',
                  '_hard_samples', '_ignore_ref', '_ignore_gerb', '_exception_by_class',
                  '_num_workers', '_required', '_require_all', '_prohibited', '_prohibit_all',
-                 '_skip_cur_check', '_strict_inspection']
+                 '_skip_cur_check', '_strict_inspection', '_lazy', '_clean_labels', '_cluster_data',
+                 '_version', '_loaded']
 
     def __init__(self,
                  path: str,
@@ -35,6 +38,8 @@ class DataPatch(object):
                  required: Union[str, List[str], None] = None,
                  prohibited: Union[str, List[str], None] = None,
                  hard_samples: Union[List, bool, None] = False,
+                 lazy: bool = False,
+                 auto_load: bool = True,
                  ):
 
         if duplicates is not None:
@@ -45,6 +50,11 @@ class DataPatch(object):
                 "hard_samples must be a Dictionary or Boolean!"
 
         self._raw_data = []
+        self._loaded = False
+        self._cluster_data = dict()
+        self._version = 0
+        self._lazy = lazy
+        self._clean_labels = clean_labels
         self._modified = True
         self._required = required
 
@@ -72,10 +82,10 @@ class DataPatch(object):
         self._exceptions = exceptions
 
         self._root = PathFormatter.format(path)
-        if os.path.exists(self._root):
-            self.load(clean_labels=clean_labels, sort_raw_data=sort_raw_data)
-        else:
+        if not os.path.exists(self._root):
             raise FileNotFoundError(f'Path does not exist: {self._root}')
+        if auto_load:
+            self.load(clean_labels=clean_labels, sort_raw_data=sort_raw_data)
 
     def __len__(self):
         return len(self.data)
@@ -107,12 +117,16 @@ class DataPatch(object):
 
     @property
     def data(self) -> DataContainer:
-        if not (self._data.is_empty() or self._modified):
+        cluster_data = [self._cluster_data.get(id(cluster)) for cluster in self.raw_data]
+        is_stale = [cached is None or cached[0] is not cluster or cached[1] != len(cluster)
+                    for cluster, cached in zip(self.raw_data, cluster_data)]
+        if not (self._data.is_empty() or self._modified or any(is_stale)):
             return self._data
         self._modified = False
+        self._cluster_data = {id(cluster): (cluster, len(cluster), cluster.data) if stale else cached
+                              for cluster, cached, stale in zip(self.raw_data, cluster_data, is_stale)}
         self._data.clear()
-        for cluster in self.raw_data:
-            self._data += cluster.data
+        self._data.merge_from(*(self._cluster_data[id(cluster)][2] for cluster in self.raw_data))
         if self._data.is_empty():
             print(f'{self._root} is empty!')
         return self._data
@@ -124,10 +138,42 @@ class DataPatch(object):
             result[cluster.label] += cluster.raw_data
         return result
 
+    @property
+    def version(self) -> int:
+        """ Increased whenever the patch is reloaded or invalidated. """
+        return self._version
+
     @property
     def raw_data(self) -> List[DataCluster]:
+        if not self._loaded:
+            self.load()
         return self._raw_data
 
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    @staticmethod
+    def fingerprint_of(path: str, depth: int = 2) -> str:
+        """ Digest of the mtimes of path and its sub-directories down to depth, e.g. "{cluster}/Cur".
+        The mtime of a directory changes whenever a file is added, removed or renamed in it.
+        """
+        hash_calc = md5()
+
+        def _update(dir_path: str, level: int):
+            hash_calc.update(f'{dir_path}|{os.stat(dir_path).st_mtime_ns}\n'.encode())
+            if level < depth:
+                with os.scandir(dir_path) as entries:
+                    sub_dirs = sorted(entry.path for entry in entries if entry.is_dir())
+                for sub_dir in sub_dirs:
+                    _update(sub_dir, level + 1)
+
+        _update(PathFormatter.format(path), 0)
+        return hash_calc.hexdigest()
+
+    def fingerprint(self) -> str:
+        return self.fingerprint_of(self._root)
+
     @property
     def size(self) -> Dict:
         return {k: len(v) for k, v in self.items()}
@@ -136,68 +182,75 @@ class DataPatch(object):
     def duplicates(self):
         return self._duplicates
 
+    def invalidate(self, cluster: Optional[DataCluster] = None) -> None:
+        """ Mark the cluster (all the clusters if None) as modified, only the modified clusters are rebuilt
+        on the next access of "data". Appending to or popping from a cluster is detected without invalidation.
+        """
+        self._modified = True
+        self._version += 1
+        if cluster is None:
+            self._cluster_data.clear()
+        else:
+            self._cluster_data.pop(id(cluster), None)
+
     def modify_data(fn):
         @wraps(fn)
         def wrapped_fn(self, *args, **kwargs):
-            self._modified = True
+            self.invalidate()
             return fn(self, *args, **kwargs)
         return wrapped_fn
 
-    @modify_data
-    def load(self,
-             clean_labels: bool = True,
-             sort_raw_data: bool = False) -> None:
+    def cluster_tasks(self, clean_labels: Optional[bool] = None) -> List[Dict]:
+        """ Keyword arguments of "DataCluster.from_path" for every cluster of the patch, in listing order. """
+        clean_labels = self._clean_labels if clean_labels is None else clean_labels
         clusters = [os.path.join(self._root, name)
                     for name in os.listdir(self._root)
                     if not (name in self._exceptions or os.path.isfile(os.path.join(self._root, name)) or
                             (self._exception_by_class and DataCluster.clean_label(name) in self._exceptions))]
+        tasks = []
+        for cluster in clusters:
+            name = os.path.basename(cluster)
+            name = DataCluster.clean_label(name) if clean_labels else name
+            hard_sample = self._hard_samples if isinstance(self._hard_samples, bool) \
+                else True if self._hard_samples is not None and name in self._hard_samples else False
+            multi = self._duplicates[name] if name in self._duplicates else self._duplicates["all"]
+            tasks.append(dict(path=cluster,
+                              separated=self._separated,
+                              ignore_ref=self._ignore_ref,
+                              ignore_gerb=self._ignore_gerb,
+                              skip_cur_check=self._skip_cur_check,
+                              clean_raw_label=clean_labels,
+                              use_single_image=self._use_single_img,
+                              strict_inspection=self._strict_inspection,
+                              required=self._required,
+                              require_all=self._require_all,
+                              prohibited=self._prohibited,
+                              prohibit_all=self._prohibit_all,
+                              hard_samples=hard_sample,
+                              duplicates=multi,
+                              lazy=self._lazy,))
+        return tasks
+
+    @modify_data
+    def load(self,
+             clean_labels: Optional[bool] = None,
+             sort_raw_data: bool = False) -> None:
+        tasks = self.cluster_tasks(clean_labels=clean_labels)
         if self._num_workers is not None and self._num_workers > 1:
             with concurrent.futures.ThreadPoolExecutor(max_workers=self._num_workers) as exe:
-                cluster_list = []
-                for cluster in clusters:
-                    name = os.path.basename(cluster)
-                    name = DataCluster.clean_label(name) if clean_labels else name
-                    hard_sample = self._hard_samples if isinstance(self._hard_samples, bool) \
-                        else True if self._hard_samples is not None and name in self._hard_samples else False
-                    multi = self._duplicates[name] if name in self._duplicates else self._duplicates["all"]
-                    cluster_list.append(exe.submit(DataCluster.from_path,
-                                                   path=cluster,
-                                                   separated=self._separated,
-                                                   ignore_ref=self._ignore_ref,
-                                                   ignore_gerb=self._ignore_gerb,
-                                                   skip_cur_check=self._skip_cur_check,
-                                                   clean_raw_label=clean_labels,
-                                                   use_single_image=self._use_single_img,
-                                                   strict_inspection=self._strict_inspection,
-                                                   required=self._required,
-                                                   require_all=self._require_all,
-                                                   prohibited=self._prohibited,
-                                                   prohibit_all=self._prohibit_all,
-                                                   hard_samples=hard_sample,
-                                                   duplicates=multi,))
-                results = [future.result() for future in concurrent.futures.as_completed(cluster_list)]
+                cluster_list = [exe.submit(DataCluster.from_path, **task) for task in tasks]
+                results = [future.result() for future in cluster_list]
         else:
-            results = []
-            for cluster in clusters:
-                name = os.path.basename(cluster)
-                name = DataCluster.clean_label(name) if clean_labels else name
-                hard_sample = self._hard_samples if isinstance(self._hard_samples, bool) \
-                    else True if self._hard_samples is not None and name in self._hard_samples else False
-                multi = self._duplicates[name] if name in self._duplicates else self._duplicates["all"]
-                results.append(DataCluster.from_path(path=cluster,
-                                                     separated=self._separated,
-                                                     ignore_ref=self._ignore_ref,
-                                                     ignore_gerb=self._ignore_gerb,
-                                                     skip_cur_check=self._skip_cur_check,
-                                                     clean_raw_label=clean_labels,
-                                                     use_single_image=self._use_single_img,
-                                                     strict_inspection=self._strict_inspection,
-                                                     required=self._required,
-                                                     require_all=self._require_all,
-                                                     hard_samples=hard_sample,
-                                                     duplicates=multi,))
-
-        self._raw_data = [cluster for cluster in results if not cluster.is_empty()]
+            results = [DataCluster.from_path(**task) for task in tasks]
+        self.set_clusters(results, sort_raw_data=sort_raw_data)
+
+    @modify_data
+    def set_clusters(self,
+                     clusters: List[DataCluster],
+                     sort_raw_data: bool = False) -> None:
+        """ Set the loaded clusters, which should be in the order of "cluster_tasks". """
+        self._raw_data = [cluster for cluster in clusters if not cluster.is_empty()]
+        self._loaded = True
         if sort_raw_data:
             self._raw_data.sort(key=lambda x: len(x.data), reverse=True)
 
@@ -205,13 +258,19 @@ class DataPatch(object):
               split_ratio: float = 0.8,
               merge_labels: Optional[Dict] = None,
               top_labels: Optional[List] = None,
-              random_seed: int = 42) -> Tuple[DataContainer, DataContainer]:
+              random_seed: int = 42,
+              split_mode: str = 'shuffle',
+              hash_by: str = 'name') -> Tuple[DataContainer, DataContainer]:
 
         allow_duplicates = self._data.allow_duplicates
         train = DataContainer(allow_duplicates=allow_duplicates)
         val = DataContainer(allow_duplicates=allow_duplicates)
         for cluster in self.raw_data:
-            cluster_train, cluster_val = cluster.split(split_ratio=split_ratio, random_seed=random_seed)
+            cluster_train, cluster_val = cluster.split(split_ratio=split_ratio,
+                                                       random_seed=random_seed,
+                                                       split_mode=split_mode,
+                                                       hash_by=hash_by,
+                                                       num_workers=self._num_workers)
             label = cluster.label
             label = merge_labels[label] if merge_labels is not None and label in merge_labels.keys() else label
             if top_labels is not None and label not in top_labels:
@@ -221,7 +280,7 @@ class DataPatch(object):
         return train, val
 
     def is_empty(self) -> bool:
-        return not self._raw_data
+        return not self.raw_data
 
     @classmethod
     def validate_datapatch(cls,
@@ -241,6 +300,7 @@ class DataPatch(object):
                            duplicates: Union[Dict, int, None] = None,
                            required: Union[str, List[str], None] = None,
                            hard_samples: Union[List, bool, None] = False,
+                           validator: Optional[DatasetValidator] = None,
                            ):
         try:
             if duplicates is None:
@@ -287,6 +347,11 @@ class DataPatch(object):
         if scanned.total_num != dp.data.total_num:
             raise IndexError(f'Invalid file structure: {path}, scanned: {scanned.total_num}, loaded: {dp.data.total_num}')
 
+        if validator is not None:
+            report = validator.validate(dp)
+            if not report.is_valid:
+                raise IndexError(f'Invalid images: {path}, {report.summary()}')
+
         return dp
 
 
@@ -0,0 +1,164 @@
+import os
+import cv2
+import numpy as np
+import pandas as pd
+import concurrent.futures
+from tqdm import tqdm
+from PIL import Image
+from typing import Optional, List, Dict, Tuple, Iterable, TYPE_CHECKING
+
+from .layer import split_target_layers
+from .convertor import ColorLUT, ImageConvertor
+
+if TYPE_CHECKING:
+    from .container import DataContainer
+    from .mappers import ClassMapper
+
+
+def _decode_index_mask(path: str, lut: ColorLUT) -> Optional[np.ndarray]:
+    """
+    Index mask of a color mask through the id-mask cache (see "ImageConvertor.load_id_mask"), ColorLUT.UNKNOWN
+    for the colors not in the mapper, single channel index masks are read as they are, None if unreadable.
+    """
+    try:
+        with Image.open(path) as image:
+            single_channel = image.mode in ['L', 'I', 'I;16']
+        if single_channel:
+            return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        return ImageConvertor.load_id_mask(path, lut, require_color_in_mapper=False)
+    except (OSError, AssertionError):
+        return None
+
+
+def _component_records(crop: np.ndarray, offset: Tuple[int, int], connectivity: int) -> List[Dict]:
+    """ Statistics of the connected components of a binary crop, bbox and centroid relative to the image. """
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(crop.view(np.uint8),
+                                                                            connectivity=connectivity,
+                                                                            ltype=cv2.CV_32S)
+    records = []
+    for i in range(1, num_labels):
+        w_min, h_min, w, h, area = stats[i].tolist()
+        contours, _ = cv2.findContours((labels[h_min:h_min + h, w_min:w_min + w] == i).view(np.uint8),
+                                       mode=cv2.RETR_EXTERNAL,
+                                       method=cv2.CHAIN_APPROX_NONE)
+        (_, _), (rect_w, rect_h), angle = cv2.minAreaRect(np.concatenate(contours))
+        records.append(dict(area=area,
+                            h_min=offset[0] + h_min,
+                            w_min=offset[1] + w_min,
+                            h_max=offset[0] + h_min + h,
+                            w_max=offset[1] + w_min + w,
+                            centroid_h=offset[0] + float(centroids[i][1]),
+                            centroid_w=offset[1] + float(centroids[i][0]),
+                            rect_min_hw=min(rect_w, rect_h),
+                            rect_max_hw=max(rect_w, rect_h),
+                            rect_angle=angle,
+                            contour_length=sum(cv2.arcLength(contour, closed=True) for contour in contours)))
+    return records
+
+
+def _extract_samples(samples: List[Tuple[str, str, str]],
+                     classes: Dict[str, int],
+                     lut: ColorLUT,
+                     connectivity: int) -> List[Dict]:
+    """ Region records of a chunk of (cluster, cur_path, mask_path) in a worker, each mask is decoded once. """
+    records = []
+    for cluster, cur_path, mask_path in samples:
+        if not os.path.isfile(mask_path):
+            continue
+        mask = _decode_index_mask(mask_path, lut)
+        if mask is None:
+            continue
+        img_area = mask.shape[0] * mask.shape[1]
+        for name, ((h_min, w_min, _, _), crop) in split_target_layers(mask, classes).items():
+            if not crop.size:
+                continue
+            for region, record in enumerate(_component_records(crop, (h_min, w_min), connectivity)):
+                records.append(dict(image=cur_path, cluster=cluster, mask=mask_path, cls=name, region=region,
+                                    **record, area_ratio=record['area'] / img_area))
+    return records
+
+
+class MaskStatistics(object):
+    """
+    Per-region statistics of the masks of a DataContainer, computed in a process pool, one record per connected
+    component of each class: image, cluster, mask, cls, region, area, bbox (h_min, w_min, h_max, w_max),
+    centroid (centroid_h, centroid_w), min-area-rect (rect_min_hw, rect_max_hw, rect_angle), contour_length
+    and area_ratio.
+
+    Each mask is decoded once and split into the classes in a single pass, the area, bbox and centroid come from
+    one labeling of each class, only the contours are computed per component.
+
+    Args:
+        class_mapper (ClassMapper): mapper of the mask colors, the classes are the merged ones.
+        attr (str): attribute of the masks.
+        ignore_classes (List[str]): classes without records, e.g. the background.
+        connectivity (int): 4 or 8.
+        num_workers (int): number of processes, computed in the current process if not greater than 1.
+        chunk_size (int): number of images processed by a worker at a time.
+    """
+    COLUMNS = ['image', 'cluster', 'mask', 'cls', 'region', 'area', 'h_min', 'w_min', 'h_max', 'w_max',
+               'centroid_h', 'centroid_w', 'rect_min_hw', 'rect_max_hw', 'rect_angle', 'contour_length', 'area_ratio']
+
+    def __init__(self,
+                 class_mapper: 'ClassMapper',
+                 attr: str = 'mask',
+                 ignore_classes: Iterable[str] = ('OK', '000'),
+                 connectivity: int = 8,
+                 num_workers: int = 8,
+                 chunk_size: int = 16):
+        assert connectivity in [4, 8], f'connectivity must be 4 or 8, {connectivity} is given'
+        self.attr = attr
+        self.connectivity = connectivity
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.classes = {name: idx for name, idx in class_mapper.name_to_idx.items() if name not in ignore_classes}
+        self.lut = ColorLUT.get(class_mapper.bgr_to_idx)
+
+    def _samples(self, container: 'DataContainer') -> List[Tuple[str, str, str]]:
+        return [(cluster, img_data.cur_path, img_data.get_renamed_path(ext='png', suffix=self.attr))
+                for cluster, images in container.items() for img_data in images]
+
+    def extract(self,
+                container: 'DataContainer',
+                file_path: Optional[str] = None,
+                review: bool = True) -> pd.DataFrame:
+        """
+        Args:
+            container (DataContainer): images whose masks are analysed.
+            file_path (str, optional): save the records to a ".parquet" or ".csv" file.
+            review (bool): whether to show the progress.
+        """
+        samples = self._samples(container)
+        chunks = [samples[i:i + self.chunk_size] for i in range(0, len(samples), self.chunk_size)]
+        shared = self.num_workers is not None and self.num_workers > 1
+        # the workers attach to a shared block of the table instead of receiving a copy with every chunk
+        lut = self.lut.copy() if shared else self.lut
+        if shared:
+            lut.share()
+        extract_args = (self.classes, lut, self.connectivity)
+
+        records = []
+        try:
+            with tqdm(total=len(samples), disable=not review) as pbar:
+                if not shared:
+                    for chunk in chunks:
+                        records.extend(_extract_samples(chunk, *extract_args))
+                        pbar.update(len(chunk))
+                else:
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers) as exe:
+                        futures = {exe.submit(_extract_samples, chunk, *extract_args): len(chunk) for chunk in chunks}
+                        for future in concurrent.futures.as_completed(futures):
+                            records.extend(future.result())
+                            pbar.update(futures[future])
+        finally:
+            if shared:
+                lut.close()
+
+        df = pd.DataFrame(records, columns=self.COLUMNS).sort_values(by=['image', 'cls', 'region'], ignore_index=True)
+        if file_path is not None:
+            if file_path.endswith('.parquet'):
+                df.to_parquet(file_path, index=False)
+            else:
+                df.to_csv(file_path, index=False)
+            print('Generated: %s' % file_path)
+        return df
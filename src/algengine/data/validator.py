@@ -0,0 +1,218 @@
+import os
+import cv2
+import json
+import numpy as np
+import pandas as pd
+import concurrent.futures
+from PIL import Image
+from tqdm import tqdm
+from collections import defaultdict
+from typing import Optional, List, Dict, Tuple, Union, Iterable, TYPE_CHECKING
+
+from .image import ImageData
+from ..utils import SuffixFormatter
+
+if TYPE_CHECKING:
+    from .mappers import ClassMapper
+
+
+def _pack_colors(colors: np.ndarray) -> np.ndarray:
+    """ Pack the (..., 3) BGR colors into uint32 keys. """
+    colors = colors.astype(np.uint32)
+    return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+
+def _probe_size(path: str) -> Tuple[int, int]:
+    """ (height, width) of the image from its header, the pixels are not decoded. """
+    with Image.open(path) as img:
+        width, height = img.size
+    return height, width
+
+
+def _check_samples(samples: List[Tuple[str, Dict[str, str]]],
+                   required: Tuple[str, ...],
+                   decode: bool,
+                   allowed_colors: Optional[np.ndarray],
+                   num_classes: Optional[int]) -> List[Tuple[str, str, str]]:
+    """ Check a chunk of (cur_path, {attr: attr_path}) in a worker, returns the problems as (problem, path, detail). """
+    problems = []
+    for cur_path, attr_paths in samples:
+        if not SuffixFormatter.is_cur(cur_path):
+            problems.append(('naming', cur_path, 'not identified as a cur image'))
+
+        sizes = dict()
+        for attr, path in [('cur', cur_path)] + list(attr_paths.items()):
+            if not os.path.isfile(path):
+                if attr == 'cur' or attr in required:
+                    problems.append(('missing', path, f'required attribute "{attr}" does not exist'))
+                continue
+            if SuffixFormatter.is_encrypted_format(path):
+                continue
+
+            try:
+                sizes[attr] = _probe_size(path)
+            except Exception as e:
+                problems.append(('unreadable', path, f'invalid header: {e}'))
+                continue
+
+            if not decode and not (attr == 'mask' and allowed_colors is not None):
+                continue
+            img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            if img is None:
+                problems.append(('unreadable', path, 'failed to decode'))
+                continue
+
+            if attr == 'mask' and allowed_colors is not None:
+                if img.ndim == 2:
+                    unknown = np.unique(img[img >= num_classes]).tolist()
+                else:
+                    keys = np.unique(_pack_colors(img[..., :3]))
+                    unknown = [((key >> 16) & 255, (key >> 8) & 255, key & 255)[::-1]
+                               for key in keys[~np.isin(keys, allowed_colors)].tolist()]
+                if unknown:
+                    problems.append(('unknown_color', path, f'values not in ClassMapper: {unknown[:8]}'))
+
+        if 'cur' in sizes:
+            for attr, size in sizes.items():
+                if size != sizes['cur']:
+                    problems.append(('shape_mismatch', attr_paths[attr],
+                                     f'{attr} {size} does not match cur {sizes["cur"]}'))
+    return problems
+
+
+class ValidationReport(object):
+    COLUMNS = ['problem', 'path', 'detail']
+
+    def __init__(self,
+                 problems: Optional[List[Tuple[str, str, str]]] = None,
+                 num_checked: int = 0,
+                 stopped_early: bool = False):
+        self.problems = [] if problems is None else problems
+        self.num_checked = num_checked
+        self.stopped_early = stopped_early
+
+    def __len__(self) -> int:
+        return len(self.problems)
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.problems
+
+    def grouped(self) -> Dict[str, List[Dict[str, str]]]:
+        ret = defaultdict(list)
+        for problem, path, detail in self.problems:
+            ret[problem].append(dict(path=path, detail=detail))
+        return dict(ret)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.problems, columns=self.COLUMNS).sort_values(by=['problem', 'path'], ignore_index=True)
+
+    def to_json(self, file_path: Optional[str] = None) -> Dict:
+        ret = dict(num_checked=self.num_checked,
+                   stopped_early=self.stopped_early,
+                   problems=self.grouped())
+        if file_path is not None:
+            with open(file_path, 'w') as f:
+                json.dump(ret, f, indent=4)
+        return ret
+
+    def summary(self) -> str:
+        counts = ', '.join(f'{problem}: {len(items)}' for problem, items in self.grouped().items())
+        ret = f'checked: {self.num_checked}, problems: {len(self)}' + (f' ({counts})' if counts else '')
+        return ret + (', stopped early' if self.stopped_early else '')
+
+    def __str__(self) -> str:
+        return self.summary()
+
+
+class DatasetValidator(object):
+    """
+    Check the images of a DataPatch, a DataCluster or a list of ImageData in a process pool:
+        naming: the cur image is not identified by its name.
+        missing: the cur image or a required attribute does not exist.
+        unreadable: the header (or the pixels with decode=True) cannot be read.
+        shape_mismatch: the size of ref/mask differs from the cur image.
+        unknown_color: the mask has colors (or indices for single channel masks) not in the class_mapper.
+
+    The sizes are probed from the image headers, the pixels are only decoded with decode=True
+    or for the color check of the masks.
+
+    Args:
+        required (str or List[str], optional): attributes that must exist, e.g. ["mask"].
+        attrs (List[str]): attributes to be checked besides cur.
+        class_mapper (ClassMapper, optional): mapper to check the mask colors against.
+        decode (bool): whether to decode all the images instead of probing their headers only.
+        num_workers (int): number of processes, checked in the current process if not greater than 1.
+        chunk_size (int): number of samples checked by a worker at a time.
+        max_errors (int, optional): stop once the number of problems reaches it.
+    """
+
+    def __init__(self,
+                 required: Union[str, List[str], None] = None,
+                 attrs: Iterable[str] = ('ref', 'mask'),
+                 class_mapper: Optional['ClassMapper'] = None,
+                 decode: bool = False,
+                 num_workers: int = 8,
+                 chunk_size: int = 64,
+                 max_errors: Optional[int] = None):
+        required = [required] if isinstance(required, str) else required
+        self.required = tuple(attr.lower() for attr in required) if required is not None else tuple()
+        self.attrs = tuple(dict.fromkeys(tuple(attr.lower() for attr in attrs) + self.required))
+        self.decode = decode
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        if class_mapper is not None:
+            self.allowed_colors = _pack_colors(np.array([color[::-1] for color in class_mapper.allowed_colors]))
+            self.num_classes = class_mapper.num_classes
+        else:
+            self.allowed_colors = None
+            self.num_classes = None
+
+    @staticmethod
+    def _collect(target) -> List[ImageData]:
+        if hasattr(target, 'raw_data'):
+            return [img_data for cluster in target.raw_data for img_data in cluster]
+        return list(target)
+
+    def _samples(self, images: List[ImageData]) -> List[Tuple[str, Dict[str, str]]]:
+        return [(img_data.cur_path,
+                 {attr: img_data.get_renamed_path(ext='png', suffix=attr) for attr in self.attrs})
+                for img_data in images]
+
+    def validate(self, target, review: bool = True) -> ValidationReport:
+        """
+        Args:
+            target (DataPatch, DataCluster or List[ImageData]): images to be checked.
+            review (bool): whether to show the progress and print the summary.
+        """
+        samples = self._samples(self._collect(target))
+        chunks = [samples[i:i + self.chunk_size] for i in range(0, len(samples), self.chunk_size)]
+        check_args = (self.required, self.decode, self.allowed_colors, self.num_classes)
+
+        report = ValidationReport()
+        with tqdm(total=len(samples), disable=not review) as pbar:
+            if self.num_workers is None or self.num_workers <= 1:
+                for chunk in chunks:
+                    report.problems.extend(_check_samples(chunk, *check_args))
+                    report.num_checked += len(chunk)
+                    pbar.update(len(chunk))
+                    if self.max_errors is not None and len(report) >= self.max_errors:
+                        report.stopped_early = report.num_checked < len(samples)
+                        break
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers) as exe:
+                    futures = {exe.submit(_check_samples, chunk, *check_args): len(chunk) for chunk in chunks}
+                    for future in concurrent.futures.as_completed(futures):
+                        report.problems.extend(future.result())
+                        report.num_checked += futures[future]
+                        pbar.update(futures[future])
+                        if self.max_errors is not None and len(report) >= self.max_errors:
+                            report.stopped_early = report.num_checked < len(samples)
+                            for pending in futures:
+                                pending.cancel()
+                            break
+
+        if review:
+            print(f'Validated: {report.summary()}')
+        return report
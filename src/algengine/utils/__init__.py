@@ -2,7 +2,7 @@ from .archive import ArchiveManager
 from .config import Config
 from .device import parse_device_id, parse_cuda_device_id
 from .formatter import SuffixFormatter, PathFormatter
-from .io import load_from, image2base64
+from .io import load_from, image2base64, read_palette_png, write_palette_png
 from .misc import exists_or_make, is_none, is_not_none, convert2map, get_local_ip, is_local_port_occupied
 from .recorder import ActionRecorder
 from .registry import Registry
@@ -13,7 +13,7 @@ __all__ = [
     'Config',
     'parse_device_id', 'parse_cuda_device_id',
     'SuffixFormatter', 'PathFormatter',
-    'load_from', 'image2base64',
+    'load_from', 'image2base64', 'read_palette_png', 'write_palette_png',
     'ActionRecorder',
     'exists_or_make', 'is_none', 'is_not_none', 'convert2map', 'get_local_ip', 'is_local_port_occupied',
     'Registry',
@@ -1,24 +1,190 @@
 import os
+import json
+import time
+import zlib
+import struct
 import shutil
+import tempfile
+import itertools
+import concurrent.futures
 from pathlib import Path
-from typing import Optional, List
+from collections import defaultdict, deque
+from typing import Optional, List, Dict, Tuple
 
 import zipfile
 import tarfile
 from tqdm import tqdm
 
 from .formatter import PathFormatter
+from .scanner import scandir
+
+
+class _ZstdTarFile(tarfile.TarFile):
+    """Tar archive read as a stream out of a zstd frame, the frame is closed together with the archive."""
+
+    @classmethod
+    def open_zst(cls, file_path: str) -> '_ZstdTarFile':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Package "zstandard" is required for "tar.zst" archives: pip install zstandard')
+
+        stream = zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+        try:
+            archive = cls.open(fileobj=stream, mode='r|')
+        except BaseException:
+            stream.close()
+            raise
+        archive.zst_stream = stream
+        return archive
+
+    def close(self) -> None:
+        try:
+            super(_ZstdTarFile, self).close()
+        finally:
+            if getattr(self, 'zst_stream', None) is not None:
+                self.zst_stream.close()
+
+
+class _ZipWriter:
+    """Write a zip archive whose members are deflated in a thread pool.
+
+    "zipfile" compresses every member inside "ZipFile.write" and allows a single writing handle at a time,
+    so the members are deflated concurrently (zlib releases the GIL) into spooled buffers here
+    and written to the archive in order, with ZIP64 records where the sizes or offsets require them.
+    """
+    LIMIT = 0xFFFFFFFF
+    CHUNK_SIZE = 1 << 20
+    SPOOL_SIZE = 64 << 20
+
+    def __init__(self, file_path: str, compresslevel: int):
+        self.file = open(file_path, 'wb')
+        self.compresslevel = compresslevel
+        self.entries = []
+
+    def __enter__(self) -> '_ZipWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        try:
+            if exc_type is None:
+                self._write_central_directory()
+        finally:
+            self.file.close()
+
+    @staticmethod
+    def _dos_time(timestamp: float) -> Tuple[int, int]:
+        t = time.localtime(timestamp)
+        if t.tm_year < 1980:
+            return 0, (1 << 5) | 1
+        return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+    def compress(self, file: str, stored: bool) -> Tuple[int, int, int, Optional[tempfile.SpooledTemporaryFile]]:
+        """Return CRC, size, compressed size and the deflated data of a file, data is None for stored files."""
+        crc, size = 0, 0
+        if stored:
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                    crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+            return crc, size, size, None
+
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        data = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE)
+        try:
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                    crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+                    data.write(compressor.compress(chunk))
+            data.write(compressor.flush())
+        except BaseException:
+            data.close()
+            raise
+        compress_size = data.tell()
+        data.seek(0)
+        return crc, size, compress_size, data
+
+    def write(self, file: str, arcname: str, stored: bool, compressed=None) -> None:
+        """Write a member, "compressed" is the result of "compress" for files and ignored for directories."""
+        stat = os.stat(file)
+        is_dir = os.path.isdir(file)
+        arcname = arcname.replace(os.sep, '/').lstrip('/')
+        if is_dir:
+            arcname = arcname.rstrip('/') + '/'
+            crc, size, compress_size, data, method = 0, 0, 0, None, zipfile.ZIP_STORED
+        else:
+            crc, size, compress_size, data = compressed
+            method = zipfile.ZIP_STORED if data is None else zipfile.ZIP_DEFLATED
+        try:
+            name = arcname.encode('ascii')
+            flags = 0
+        except UnicodeEncodeError:
+            name = arcname.encode('utf-8')
+            flags = 0x800
+        dos_time, dos_date = self._dos_time(stat.st_mtime)
+        offset = self.file.tell()
+        zip64 = size > self.LIMIT or compress_size > self.LIMIT
+        extra = struct.pack('<HHQQ', 1, 16, size, compress_size) if zip64 else b''
+        self.file.write(struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', 45 if zip64 else 20, flags, method,
+                                    dos_time, dos_date, crc,
+                                    self.LIMIT if zip64 else compress_size, self.LIMIT if zip64 else size,
+                                    len(name), len(extra)))
+        self.file.write(name)
+        self.file.write(extra)
+        try:
+            if data is not None:
+                shutil.copyfileobj(data, self.file, self.CHUNK_SIZE)
+            elif not is_dir:
+                with open(file, 'rb') as f:
+                    shutil.copyfileobj(f, self.file, self.CHUNK_SIZE)
+        finally:
+            if data is not None:
+                data.close()
+        external_attr = (stat.st_mode & 0xFFFF) << 16 | (0x10 if is_dir else 0)
+        self.entries.append((name, flags, method, dos_time, dos_date, crc, compress_size, size, offset, external_attr))
+
+    def _write_central_directory(self) -> None:
+        start = self.file.tell()
+        for name, flags, method, dos_time, dos_date, crc, compress_size, size, offset, external_attr in self.entries:
+            fields = [value for value in (size, compress_size, offset) if value > self.LIMIT]
+            extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+            version = 45 if fields else 20
+            self.file.write(struct.pack('<4sHHHHHHLLLHHHHHLL', b'PK\x01\x02', (3 << 8) | version, version,
+                                        flags, method, dos_time, dos_date, crc,
+                                        min(compress_size, self.LIMIT), min(size, self.LIMIT),
+                                        len(name), len(extra), 0, 0, 0, external_attr, min(offset, self.LIMIT)))
+            self.file.write(name)
+            self.file.write(extra)
+        end = self.file.tell()
+        count, size = len(self.entries), end - start
+        if count > 0xFFFF or size > self.LIMIT or start > self.LIMIT:
+            self.file.write(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, (3 << 8) | 45, 45,
+                                        0, 0, count, count, size, start))
+            self.file.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, end, 1))
+        self.file.write(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                    min(size, self.LIMIT), min(start, self.LIMIT), 0))
 
 
 class ArchiveManager:
     FILE_EXT = {
         'tar': ['gz', 'tgz', 'tar'],
+        'tar.zst': ['zst'],
         'zip': ['zip', '7z'],
     }
+    ARCHIVE_FORMAT = ['zip', 'tar.zst']
+    STORED_EXT = ['png', 'jpg', 'jpeg', 'gif', 'webp', 'mp4', 'mov', 'zip', '7z', 'gz', 'tgz', 'zst']
+    JOURNAL_NAME = '.extract_journal.jsonl'
+    TEMP_PREFIX = '.extracting_'
 
     def __init__(self, ):
         pass
 
+    @staticmethod
+    def _extraction_target(file_path: str, dst: Optional[str] = None) -> str:
+        """Directory an archive is extracted to by "extract_all", named after the archive."""
+        file_root, file_name = os.path.split(file_path)
+        return os.path.join(file_root if dst is None else dst, file_name.split('.')[0])
+
     @staticmethod
     def _get_archive(file_path: str):
         assert os.path.isfile(file_path), f'File not found: {file_path}'
@@ -26,6 +192,8 @@ class ArchiveManager:
         name, *mid, ext = file_name.split('.')
         if ext in ArchiveManager.FILE_EXT['tar']:
             return tarfile.open(file_path), file_root, name
+        elif ext in ArchiveManager.FILE_EXT['tar.zst']:
+            return _ZstdTarFile.open_zst(file_path), file_root, name
         elif ext in ArchiveManager.FILE_EXT['zip']:
             return zipfile.ZipFile(file_path), file_root, name
         else:
@@ -54,10 +222,245 @@ class ArchiveManager:
             print(f'> Archive File Deleted: {file_path}')
 
 
+    @staticmethod
+    def find_archives(root: str,
+                      recursive: bool = True,
+                      exceptions: Optional[List[str]] = None) -> List[str]:
+        """Find all the archives under root, skipping the names listed in exceptions."""
+        root = PathFormatter.format(root)
+        extensions = tuple('.' + ext for exts in ArchiveManager.FILE_EXT.values() for ext in exts)
+        exceptions = [] if exceptions is None else exceptions
+        return sorted(file_path for file_path in scandir(root, with_extension=extensions, recursive=recursive)
+                      if os.path.basename(file_path) not in exceptions
+                      and ArchiveManager.TEMP_PREFIX not in file_path)
+
+    @staticmethod
+    def _journal_key(file_path: str) -> str:
+        stat = os.stat(file_path)
+        return f'{file_path}|{stat.st_size}|{stat.st_mtime_ns}'
+
+    @staticmethod
+    def _load_journal(journal: str) -> set:
+        finished = set()
+        if os.path.isfile(journal):
+            with open(journal, 'r') as f:
+                for line in f:
+                    try:
+                        finished.add(json.loads(line)['key'])
+                    except (ValueError, KeyError):
+                        continue
+        return finished
+
+    @staticmethod
+    def _extract_atomic(file_path: str,
+                        dst: Optional[str] = None,
+                        force: bool = True) -> Dict:
+        """Extract an archive into a temporary directory next to the target and rename it into place.
+
+        The target directory appears only after the whole archive is extracted, an interrupted
+        extraction leaves a ".extracting_*" directory behind instead of a half-filled target.
+        """
+        start = time.time()
+        archive, file_root, name = ArchiveManager._get_archive(file_path)
+        dst = file_root if dst is None else dst
+        target = os.path.join(dst, name)
+        os.makedirs(dst, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=ArchiveManager.TEMP_PREFIX + name + '_', dir=dst)
+        try:
+            with archive:
+                archive.extractall(temp_dir)
+            if os.path.exists(target):
+                if not force:
+                    raise FileExistsError(f'Extraction target exists: {target}\n'
+                                          f'Use "force = True" to replace the original directory.')
+                shutil.rmtree(target)
+            os.replace(temp_dir, target)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        return {'archive': file_path,
+                'target': target,
+                'size': os.path.getsize(file_path),
+                'duration': time.time() - start}
+
     @staticmethod
     def extract_all(root: str,
-                    exceptions: Optional[List[str]] = None):
-        pass
+                    dst: Optional[str] = None,
+                    exceptions: Optional[List[str]] = None,
+                    recursive: bool = True,
+                    num_workers: int = 4,
+                    force: bool = True,
+                    journal: Optional[str] = None,
+                    delete_after_extraction: bool = False) -> Dict:
+        """Extract all the archives under root in a process pool.
+
+        Every archive is extracted to its own directory named after the archive, next to the archive
+        or under dst if given. Finished archives are recorded in a journal (".extract_journal.jsonl" under root
+        by default), so that a re-run skips the archives which have not changed since.
+        Archives which would be extracted to the same directory raise FileExistsError before anything is extracted.
+
+        Args:
+            root (str): Directory to search for archives.
+            dst (str, optional): Directory to extract to, default to the directory of each archive.
+            exceptions (List[str], optional): File names of the archives to be skipped.
+            recursive (bool): Whether to search archives recursively.
+            num_workers (int): Number of worker processes, extract in the current process if <= 1.
+            force (bool): Whether to replace the existing extraction target.
+            journal (str, optional): Path of the journal file.
+            delete_after_extraction (bool): Whether to delete the archive after extraction.
+
+        Returns:
+            Dict: extracted, skipped and failed archives, total size in MB, duration and throughput in MB/s.
+        """
+        root = PathFormatter.format(root)
+        dst = PathFormatter.format(dst) if dst is not None else None
+        journal = os.path.join(root, ArchiveManager.JOURNAL_NAME) if journal is None else PathFormatter.format(journal)
+
+        archives = ArchiveManager.find_archives(root, recursive=recursive, exceptions=exceptions)
+        targets = defaultdict(list)
+        for file_path in archives:
+            targets[ArchiveManager._extraction_target(file_path, dst)].append(file_path)
+        collisions = {target: paths for target, paths in targets.items() if len(paths) > 1}
+        if collisions:
+            raise FileExistsError('Archives extracted to the same target:\n' +
+                                  '\n'.join(f'{target}: {paths}' for target, paths in collisions.items()) +
+                                  '\nUse "exceptions" to skip some of them or extract them separately.')
+
+        finished = ArchiveManager._load_journal(journal)
+        todo, skipped = dict(), []
+        for file_path in archives:
+            key = ArchiveManager._journal_key(file_path)
+            if key in finished:
+                skipped.append(file_path)
+            else:
+                todo[file_path] = key
+        print(f'> Archives Found: {len(todo) + len(skipped)}, Skipped (in journal): {len(skipped)}')
+
+        start = time.time()
+        extracted, failed = [], dict()
+        with open(journal, 'a') as journal_file, tqdm(total=len(todo)) as pbar:
+            def on_done(file_path, result=None, error=None):
+                if error is not None:
+                    failed[file_path] = repr(error)
+                else:
+                    extracted.append(result)
+                    journal_file.write(json.dumps({'key': todo[file_path], 'target': result['target']}) + '\n')
+                    journal_file.flush()
+                pbar.update()
+
+            if num_workers is not None and num_workers > 1:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as exe:
+                    futures = {exe.submit(ArchiveManager._extract_atomic, file_path, dst, force): file_path
+                               for file_path in todo}
+                    for future in concurrent.futures.as_completed(futures):
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            on_done(futures[future], error=e)
+                        else:
+                            on_done(futures[future], result=result)
+            else:
+                for file_path in todo:
+                    try:
+                        result = ArchiveManager._extract_atomic(file_path, dst, force)
+                    except Exception as e:
+                        on_done(file_path, error=e)
+                    else:
+                        on_done(file_path, result=result)
+
+        if delete_after_extraction:
+            for result in extracted:
+                try:
+                    os.remove(result['archive'])
+                except OSError as e:
+                    print(f'> Archive Not Deleted: {result["archive"]}, {e!r}')
+
+        duration = time.time() - start
+        total_mb = sum(result['size'] for result in extracted) / (1024 * 1024)
+        throughput = total_mb / duration if duration > 0 else 0.
+        print(f'> Archives Extracted: {len(extracted)}, Failed: {len(failed)}, '
+              f'{total_mb:.1f} MB in {duration:.1f} s ({throughput:.1f} MB/s)')
+        for file_path, error in failed.items():
+            print(f'> Extraction Failed: {file_path}, {error}')
+
+        return {'extracted': [result['archive'] for result in extracted],
+                'skipped': skipped,
+                'failed': failed,
+                'total_mb': total_mb,
+                'duration': duration,
+                'throughput': throughput}
+
+    @staticmethod
+    def _collect_members(src: str,
+                         target: Optional[List[str]] = None,
+                         exceptions: Optional[List[str]] = None) -> List[Tuple[str, str]]:
+        """Collect (path, archive name) of the directories and files to be archived, in a deterministic order.
+
+        Every directory comes before its content, so that empty directories are archived as well.
+        """
+        dir_list = sorted(os.listdir(src)) if target is None else target
+        members = []
+        for tgt_dir in dir_list:
+            if exceptions is not None and tgt_dir in exceptions:
+                continue
+            tgt_path = os.path.join(src, tgt_dir)
+            if os.path.isfile(tgt_path):
+                members.append((tgt_path, tgt_dir))
+                continue
+            for root, dirs, files in os.walk(tgt_path):
+                dirs.sort()
+                members.append((root, os.path.relpath(root, src)))
+                for file in sorted(files):
+                    file_path = os.path.join(root, file)
+                    members.append((file_path, os.path.relpath(file_path, src)))
+        return members
+
+    @staticmethod
+    def _make_zip(file_path: str,
+                  members: List[Tuple[str, str]],
+                  num_workers: int,
+                  compresslevel: int) -> None:
+        """Deflate the members in a thread pool and write them in order,
+        files which are compressed already (see "STORED_EXT") are stored."""
+        num_workers = max(1, num_workers or 1)
+        with _ZipWriter(file_path, compresslevel) as archive, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as exe, \
+                tqdm(total=len(members)) as pbar:
+            pending = deque()
+            members = iter(members)
+            while True:
+                # keep a bounded window of members in flight, so that the deflated buffers do not pile up
+                for file, arcname in itertools.islice(members, 2 * num_workers - len(pending)):
+                    stored = os.path.splitext(file)[1][1:].lower() in ArchiveManager.STORED_EXT
+                    future = None if os.path.isdir(file) else exe.submit(archive.compress, file, stored)
+                    pending.append((file, arcname, stored, future))
+                if not pending:
+                    break
+                file, arcname, stored, future = pending.popleft()
+                try:
+                    archive.write(file, arcname, stored, None if future is None else future.result())
+                except BaseException:
+                    for *_, future in pending:
+                        if future is not None:
+                            future.cancel()
+                    raise
+                pbar.update()
+
+    @staticmethod
+    def _make_tar_zst(file_path: str,
+                      members: List[Tuple[str, str]],
+                      num_workers: int,
+                      compresslevel: int) -> None:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Package "zstandard" is required for "tar.zst" archives: pip install zstandard')
+
+        compressor = zstandard.ZstdCompressor(level=compresslevel, threads=num_workers)
+        with open(file_path, 'wb') as f, compressor.stream_writer(f) as writer, \
+                tarfile.open(fileobj=writer, mode='w|') as archive:
+            for file, arcname in tqdm(members):
+                archive.add(file, arcname=arcname, recursive=False)
 
     @staticmethod
     def make_archive(src: str,
@@ -65,33 +468,56 @@ class ArchiveManager:
                      dst: Optional[str] = None,
                      force: bool = False,
                      target: Optional[List[str]] = None,
-                     exceptions: Optional[List[str]] = None):
+                     exceptions: Optional[List[str]] = None,
+                     archive_format: str = 'zip',
+                     num_workers: int = 8,
+                     compresslevel: Optional[int] = None) -> str:
+        """Archive the directory src without changing the working directory.
+
+        Zip members are deflated in a thread pool and written in order, the files which are compressed already
+        (see "STORED_EXT") are stored. "tar.zst" archives are compressed by multi-threaded zstd.
+        Empty directories are kept in both formats.
+
+        Args:
+            src (str): Directory to be archived.
+            name (str, optional): Name of the archive, default to the name of src.
+            dst (str, optional): Directory to save the archive, default to the parent of src.
+            force (bool): Whether to replace the existing archive.
+            target (List[str], optional): Sub-directories or files of src to be archived.
+            exceptions (List[str], optional): Sub-directories or files of src to be skipped.
+            archive_format (str): "zip" or "tar.zst".
+            num_workers (int): Number of compression threads.
+            compresslevel (int, optional): Compression level, default to 6 for zip and 3 for zstd.
+
+        Returns:
+            str: Path of the archive.
+        """
+        assert archive_format in ArchiveManager.ARCHIVE_FORMAT, \
+            f'archive_format must be in {ArchiveManager.ARCHIVE_FORMAT}, {archive_format} is given'
         src = Path(PathFormatter.format(src))
-        # src_root, src_name = os.path.split(src)
         name = src.name if name is None else name
-        dst = src.parent if dst is None else dst
-        if target is None and exceptions is None:
-            file_path = shutil.make_archive(os.path.join(dst, name), 'zip', src)
+        dst = src.parent if dst is None else PathFormatter.format(dst)
+        file_path = os.path.join(dst, '.'.join([name, archive_format]))
+        if os.path.exists(file_path):
+            if force:
+                print('> Original Archive File Removed!')
+                os.remove(file_path)
+            else:
+                raise FileExistsError(f'Archive File Exists: {file_path}\n'
+                                      f'Use "force = True" to replace the original archive file.')
+
+        members = ArchiveManager._collect_members(str(src), target=target, exceptions=exceptions)
+        if archive_format == 'zip':
+            ArchiveManager._make_zip(file_path, members,
+                                     num_workers=num_workers,
+                                     compresslevel=6 if compresslevel is None else compresslevel)
         else:
-            file_path = os.path.join(dst, '.'.join([name, 'zip']))
-            if os.path.exists(file_path):
-                if force:
-                    print('> Original Archive File Removed!')
-                    os.remove(file_path)
-                else:
-                    raise FileExistsError(f'Archive File Exists: {file_path}\n'
-                                          f'Use "force = True" to replace the original archive file.')
-            with zipfile.ZipFile(file_path, 'a') as archive:
-                dir_list = os.listdir(src) if target is None else target
-                os.chdir(src)
-                for tgt_dir in tqdm(dir_list):
-                    if exceptions is None or tgt_dir not in exceptions:
-                        for root, _, files in os.walk(tgt_dir):
-                            for file in files:
-                                archive.write(os.path.join(root, file), compress_type=zipfile.ZIP_DEFLATED)
+            ArchiveManager._make_tar_zst(file_path, members,
+                                         num_workers=num_workers,
+                                         compresslevel=3 if compresslevel is None else compresslevel)
 
         print(f'> Archive Created: {file_path}')
-
+        return file_path
 
 
 # if __name__ == '__main__':
@@ -137,3 +137,36 @@ def load_from(image: Union[str, Path, np.ndarray, Image.Image],
         return ndarray2image(image, mode=mode) if 'pillow' in backend else image2ndarray(image, mode=mode)
     raise ValueError(f'Invalid path type: {type(image)}')
 
+
+
+def read_palette_png(path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Read the index plane and the palette of a palette-mode ("P") image, None if the image has no palette.
+
+    Returns:
+        index: (np.ndarray) uint8 index plane, shape=(H, W)
+        palette: (np.ndarray) RGB colors of the indices, shape=(256, 3)
+    """
+    with Image.open(path) as image:
+        if image.mode != 'P':
+            return None
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        colors = np.frombuffer(bytes(image.getpalette(rawmode='RGB')), dtype=np.uint8).reshape(-1, 3)[:256]
+        palette[:len(colors)] = colors
+        return np.asarray(image), palette
+
+
+def write_palette_png(path: str, index: np.ndarray, palette: np.ndarray) -> bool:
+    """
+    Write a uint8 index plane as a palette-mode PNG, which shows the palette colors in viewers.
+
+    Args:
+        path: (str) path of the png
+        index: (np.ndarray) uint8 index plane, shape=(H, W)
+        palette: (np.ndarray) RGB colors of the indices, shape=(N, 3), N <= 256
+    """
+    image = Image.fromarray(np.ascontiguousarray(index, dtype=np.uint8))
+    # an "L" image becomes a "P" image with the palette
+    image.putpalette(np.asarray(palette, dtype=np.uint8).ravel().tolist())
+    image.save(path, format='PNG')
+    return True
@@ -1,33 +1,58 @@
+import pickle
 from collections import defaultdict
-from .config import Config
 
 
 
 class ActionRecorder:
     def __init__(self, obj_type):
         self.actions = defaultdict(ActionRecorder.default_fn)
+        self.sequence = []
         self.obj_type = obj_type
 
     @staticmethod
     def default_fn():
-        return Config(list)
+        return {'args': [], 'kwargs': []}
+
+    def record(self, action, args, kwargs):
+        self.actions[action]['args'].append(args)
+        self.actions[action]['kwargs'].append(kwargs)
+        self.sequence.append((action, args, kwargs))
 
     def items(self):
         for key, value in self.actions.items():
-            yield key, value.args, value.kwargs
+            yield key, value['args'], value['kwargs']
+
+    def steps(self):
+        """ Recorded actions as (action, args, kwargs) in the order they were called. """
+        for action, args, kwargs in self.sequence:
+            yield action, args, kwargs
 
     def __getitem__(self, item):
         return self.actions[item]
 
+    def __len__(self):
+        return len(self.sequence)
+
     def duplicate_action(self, obj):
         assert isinstance(obj, self.obj_type), f'Current ActionRecorder only works for {self.obj_type}'
-        for action, args, kwargs in self.items():
-            for iter_args, iter_kwargs in zip(args, kwargs):
-                todo = getattr(obj, action)
-                todo(*iter_args, **iter_kwargs)
+        for action, args, kwargs in self.steps():
+            todo = getattr(obj, action)
+            todo(*args, **kwargs)
+
+    def dump(self, file_path):
+        with open(file_path, 'wb') as f:
+            pickle.dump(dict(obj_type=self.obj_type, sequence=self.sequence), f)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as f:
+            state = pickle.load(f)
+        recorder = cls(state['obj_type'])
+        for action, args, kwargs in state['sequence']:
+            recorder.record(action, args, kwargs)
+        return recorder
 
     def __str__(self):
         ret = '\n'.join([f'{self.obj_type.__name__}.{fn}(*{args}, **{kwargs})'
-                         for fn in self.actions
-                         for args, kwargs in zip(self.actions[fn].args, self.actions[fn].kwargs)])
-        return ret
\ No newline at end of file
+                         for fn, args, kwargs in self.steps()])
+        return ret